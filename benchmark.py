@@ -0,0 +1,238 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import platform
+import argparse
+import resource
+import tempfile
+
+import cv2
+import numpy as np
+
+from cell_preprocess import preprocess_cell
+from detect_table import detect_table_image
+from pipeline import decode_image, run_pipeline
+from split_table import CellGrid, cell_rects, classify_cell, classify_cells, crop_cells, cut_cells, extract_grid, warp_table
+from store_recognition import (
+    MATCH_ACCEPT, MATCH_INDEX, MATCH_METHOD, MATCH_TOP_K, candidate_templates, compare_image, compare_to_directory, get_template_bank,
+    match_templates, pruning_recall
+)
+
+# 同梱のサンプル画像を使ったオフラインのベンチマーク。
+# 各ステージと全体の処理時間（パーセンタイル）・スループット・ピーク RSS を測り、
+# JSON に保存して、保存済みのベースラインと比較できる。
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TABLE_IMAGES = [os.path.join(BASE_DIR, "001.jpeg"), os.path.join(BASE_DIR, "imagedata", "EPSON001.JPG")]
+TEMPLATE_DIR = os.path.join(BASE_DIR, "store_templates")
+SCALES = (0.5, 1.0, 1.5)
+EARLY_EXIT_ACCEPT = 0.8  # match_early_exit の打ち切りのスコア（MATCH_ACCEPT が無効な場合）
+SHORTLIST_TOP_K = 3  # shortlist_* と shortlist_recall の K（--top-k・MATCH_TOP_K が 0 の場合）
+
+def percentiles(samples):
+    ms = np.array(samples) * 1000
+    return {
+        "n": len(samples),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "throughput_per_s": float(len(samples) / ms.sum() * 1000) if ms.sum() > 0 else 0.0
+    }
+
+def measure(fn, inputs, repeat):
+    """ inputs の各要素に fn を repeat 回ずつ適用し、1回ごとの所要時間を返す """
+    samples = []
+    for _ in range(repeat):
+        for item in inputs:
+            start = time.perf_counter()
+            fn(item)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+def peak_rss_mb():
+    # Linux では KiB、macOS では byte
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def load_variants():
+    """ 同梱画像と、その拡大・縮小版（合成データ）を (name, bytes, color) で返す """
+    variants = []
+    for path in TABLE_IMAGES:
+        with open(path, "rb") as f:
+            data = f.read()
+        image = decode_image(data)
+        for scale in SCALES:
+            if scale == 1.0:
+                variants.append((f"{os.path.basename(path)}@1.0", data, image))
+                continue
+            scaled = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            ok, buf = cv2.imencode(".jpeg", scaled, [int(cv2.IMWRITE_JPEG_QUALITY), 95])
+            variants.append((f"{os.path.basename(path)}@{scale}", buf.tobytes(), scaled))
+    return variants
+
+def text_cells():
+    """
+    照合ステージの入力：TABLE_IMAGES をパイプライン（表検出・切り出し・空欄判定）に通し、
+    "text" と判定されたセルを (name, cell_image) で返す
+    """
+    cells = []
+    for path in TABLE_IMAGES:
+        with open(path, "rb") as f:
+            data = f.read()
+        result = run_pipeline(decode_image(data), hashlib.md5(data).hexdigest(), TEMPLATE_DIR, ocr=False)
+        name = os.path.splitext(os.path.basename(path))[0]
+        for (r, c, cell), info in zip(result["cells"], result["cells_info"]):
+            if info["type"] == "text":
+                cells.append((f"{name}_{r}_{c}", cell))
+    return cells
+
+def warp_cells(image, table_coords):
+    """ 従来の切り出し：表全体を射影変換してからセルを切り出し、リサイズする """
+    table_warped, _, (width, height) = warp_table(image, table_coords)
+    return crop_cells(table_warped, cell_rects(width, height))
+
+def run(repeat=5, top_k=None):
+    bank = get_template_bank(TEMPLATE_DIR)
+    bank.templates()
+
+    variants = load_variants()
+    grays = [cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) for _, _, image in variants]
+    coords = [detect_table_image(gray) for gray in grays]
+    tables = [cut_cells(image, table_coords)[1] for (_, _, image), table_coords in zip(variants, coords)]
+    cells = [cell for table in tables for cell in table]
+    matched_cells = text_cells()
+    cell_targets = [preprocess_cell(cell) for _, cell in matched_cells]
+    # compare_to_directory は画像のパスを受け取るので、セルを一時ディレクトリに書き出す（可逆の PNG）
+    cell_dir = tempfile.TemporaryDirectory()
+    cell_paths = []
+    for name, cell in matched_cells:
+        cell_paths.append(os.path.join(cell_dir.name, f"{name}.png"))
+        cv2.imwrite(cell_paths[-1], cell)
+
+    # 周波数領域での照合と matchTemplate のスコアの差（最大）
+    fft_deviation = 0.0
+    for target in cell_targets:
+        spatial = {filename: score for filename, score, _, _ in compare_image(target, bank.templates())}
+        for filename, score, _, _ in compare_image(target, bank.templates(), bank.template_spectra()):
+            fft_deviation = max(fft_deviation, abs(score - spatial[filename]))
+
+    stages = {}
+    total_start = time.perf_counter()
+
+    stages["decode"] = measure(lambda v: decode_image(v[1]), variants, repeat)
+    stages["detect_table"] = measure(detect_table_image, grays, repeat)
+    # split_table は CellGrid の作成＋切り出し、cell_grid_build は行列の作成のみ。
+    # warp_and_crop は従来の表全体の射影変換＋切り出し
+    stages["extract_grid"] = measure(lambda v: extract_grid(v[0], v[1]), list(zip(grays, coords)), repeat)
+    stages["split_table"] = measure(lambda v: cut_cells(v[0][2], v[1]), list(zip(variants, coords)), repeat)
+    stages["cell_grid_build"] = measure(CellGrid, coords, repeat)
+    stages["warp_and_crop"] = measure(lambda v: warp_cells(v[0][2], v[1]), list(zip(variants, coords)), repeat)
+    # classify_cell は 1 セル、classify_cells は表の全セル（パイプラインで使う方）
+    stages["classify_cell"] = measure(lambda cell: classify_cell(cell[2], None, cell[0], cell[1]), cells, repeat)
+    stages["classify_cells"] = measure(classify_cells, tables, repeat)
+    stages["preprocess_cell"] = measure(lambda cell: preprocess_cell(cell[2]), cells, repeat)
+    stages["compare_to_directory"] = measure(lambda path: compare_to_directory(path, TEMPLATE_DIR), cell_paths, repeat)
+    cell_dir.cleanup()
+    stages["match_templates"] = measure(lambda target: match_templates(target, bank, top_k), cell_targets, repeat)
+    # 打ち切りあり（MATCH_ACCEPT が無効なら EARLY_EXIT_ACCEPT で測る）
+    accept = MATCH_ACCEPT if MATCH_ACCEPT > 0 else EARLY_EXIT_ACCEPT
+    stages["match_early_exit"] = measure(lambda target: match_templates(target, bank, top_k, accept=accept), cell_targets, repeat)
+    # 候補の絞り込みだけ（索引と縮小画像での全探索）。全探索が既定なので、その場合は SHORTLIST_TOP_K で測る
+    shortlist_k = (top_k if top_k is not None else MATCH_TOP_K) or SHORTLIST_TOP_K
+    stages["shortlist_orb"] = measure(lambda target: candidate_templates(target, bank, shortlist_k, index="orb"), cell_targets, repeat)
+    stages["shortlist_coarse"] = measure(lambda target: candidate_templates(target, bank, shortlist_k, index="coarse"), cell_targets, repeat)
+    # 全テンプレートとの原寸照合（matchTemplate と周波数領域）
+    spectra = bank.template_spectra()
+    stages["compare_spatial"] = measure(lambda target: compare_image(target, bank.templates()), cell_targets, repeat)
+    stages["compare_fft"] = measure(lambda target: compare_image(target, bank.templates(), spectra), cell_targets, repeat)
+    stages["pipeline"] = measure(
+        lambda v: run_pipeline(decode_image(v[1]), hashlib.md5(v[1]).hexdigest(), TEMPLATE_DIR, top_k=top_k),
+        variants, repeat
+    )
+
+    summary = {name: percentiles(samples) for name, samples in stages.items()}
+    # 全探索の最良スコアが 0.5 以上のセル（recall_cells 個）で、絞り込み後も最良が残った割合
+    recall, recall_cells = pruning_recall(cell_targets, bank, shortlist_k)
+    recall_by_index = {index: pruning_recall(cell_targets, bank, shortlist_k, index=index)[0] for index in ("coarse", "orb")}
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count()
+        },
+        "config": {
+            "repeat": repeat,
+            "top_k": top_k,
+            "shortlist_top_k": shortlist_k,
+            "match_index": MATCH_INDEX,
+            "match_method": MATCH_METHOD,
+            "variants": [name for name, _, _ in variants],
+            "cell_images": len(cell_targets),
+            "templates": len(bank.templates())
+        },
+        "stages": summary,
+        "accuracy": {
+            "shortlist_recall": recall,
+            "shortlist_recall_cells": recall_cells,
+            "shortlist_recall_by_index": recall_by_index,
+            "fft_max_score_diff": fft_deviation
+        },
+        "wall_s": time.perf_counter() - total_start,
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+def compare(result, baseline, threshold):
+    """ ベースラインと p50 を比較し、threshold を超えて遅くなったステージのリストを返す """
+    regressions = []
+    print(f"{'stage':<22}{'baseline p50':>14}{'current p50':>14}{'ratio':>8}")
+    for name, current in result["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if base is None:
+            print(f"{name:<22}{'-':>14}{current['p50_ms']:>12.2f}ms{'':>8}")
+            continue
+        ratio = current["p50_ms"] / base["p50_ms"] if base["p50_ms"] > 0 else float("inf")
+        mark = ""
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            mark = "  <-- slower"
+        print(f"{name:<22}{base['p50_ms']:>12.2f}ms{current['p50_ms']:>12.2f}ms{ratio:>8.2f}{mark}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="同梱画像で detect/split/match パイプラインのベンチマークを実行する")
+    parser.add_argument("--repeat", type=int, default=5, help="各入力の繰り返し回数")
+    parser.add_argument("--top-k", type=int, default=None, help="粗密探索の K（省略時は MATCH_TOP_K、0 で全探索）")
+    parser.add_argument("--output", help="結果を保存する JSON ファイル")
+    parser.add_argument("--baseline", help="比較するベースラインの JSON ファイル")
+    parser.add_argument("--threshold", type=float, default=0.1, help="p50 がこの割合を超えて遅くなったら失敗（既定 0.1 = 10%%）")
+    args = parser.parse_args()
+
+    result = run(args.repeat, args.top_k)
+
+    for name, stats in result["stages"].items():
+        print(f"{name:<22} p50={stats['p50_ms']:9.2f}ms p90={stats['p90_ms']:9.2f}ms "
+              f"p99={stats['p99_ms']:9.2f}ms {stats['throughput_per_s']:9.1f}/s")
+    print(f"shortlist recall: {result['accuracy']['shortlist_recall']:.3f} "
+          f"({result['accuracy']['shortlist_recall_cells']} cells, K={result['config']['shortlist_top_k']}, "
+          + ", ".join(f"{index}={r:.3f}" for index, r in result["accuracy"]["shortlist_recall_by_index"].items()) + ")")
+    print(f"fft vs matchTemplate: max score diff {result['accuracy']['fft_max_score_diff']:.2e}")
+    print(f"peak RSS: {result['peak_rss_mb']:.1f} MB, wall: {result['wall_s']:.1f} s")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        print()
+        if compare(result, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
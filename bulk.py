@@ -0,0 +1,119 @@
+import os
+import sys
+import json
+import hashlib
+import zipfile
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from pipeline import store_upload
+from result_cache import ResultCache
+from split_table import OUTPUT_ROOT
+from store_recognition import get_template_bank
+from upload_index import get_upload_index
+
+# 大量の時刻表画像をまとめて処理する。
+# テンプレートは共有の TemplateBank を使い、画像単位でワーカーに振り分け、
+# 終わったものから 1 行 1 件の NDJSON で結果を返す。
+BULK_WORKERS = int(os.environ.get("TIMETABLE_BULK_WORKERS", "4"))
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg')
+
+def iter_directory(directory_path):
+    """ ディレクトリ内（サブディレクトリを含む）の画像を (name, bytes) で順に返す """
+    for root, _, files in os.walk(directory_path):
+        for filename in sorted(files):
+            if not filename.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            path = os.path.join(root, filename)
+            with open(path, "rb") as f:
+                yield os.path.relpath(path, directory_path), f.read()
+
+def iter_zip(zip_file):
+    """ zip アーカイブ内の画像を (name, bytes) で順に返す（パスまたはファイルオブジェクト） """
+    with zipfile.ZipFile(zip_file) as zf:
+        for info in zf.infolist():
+            if info.is_dir() or not info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            yield info.filename, zf.read(info)
+
+def iter_path(path):
+    """ ディレクトリ・zip・単体画像のいずれかから (name, bytes) を返す """
+    if os.path.isdir(path):
+        yield from iter_directory(path)
+    elif zipfile.is_zipfile(path):
+        yield from iter_zip(path)
+    else:
+        with open(path, "rb") as f:
+            yield os.path.basename(path), f.read()
+
+def _process_one(name, file_data, output_root, cache, index):
+    file_hash = hashlib.md5(file_data).hexdigest()
+    try:
+        result = store_upload(file_data, file_hash, output_root, cache, index)
+        return {"name": name, "md5": file_hash, "status": "done", "result": result}
+    except Exception as e:
+        return {"name": name, "md5": file_hash, "status": "error", "error": str(e)}
+
+def process_many(items, output_root=OUTPUT_ROOT, cache=None, workers=BULK_WORKERS, index=None):
+    """
+    (name, bytes) の列をワーカーで並列に処理し、終わった順に結果の dict を返す
+
+    :param index: upload_index.UploadIndex（保存した元画像を登録する）
+
+    同時に読み込む画像は workers * 2 件までに抑える。
+    """
+    # テンプレートは最初に一度だけ読み込み、全画像で共有する
+    get_template_bank().templates()
+
+    items = iter(items)
+    max_pending = max(1, workers) * 2
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="bulk") as executor:
+        pending = set()
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_pending:
+                try:
+                    name, file_data = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending.add(executor.submit(_process_one, name, file_data, output_root, cache, index))
+
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+def to_ndjson(results):
+    """ 結果の dict を NDJSON の行に変換 """
+    for result in results:
+        yield json.dumps(result, ensure_ascii=False) + "\n"
+
+def main():
+    parser = argparse.ArgumentParser(description="ディレクトリ・zip 内の時刻表画像をまとめて解析し、NDJSON を出力する")
+    parser.add_argument("paths", nargs="+", help="画像ディレクトリ・zip・画像ファイルのパス")
+    parser.add_argument("--output-root", default=OUTPUT_ROOT, help="セル画像と cells.json の出力先")
+    parser.add_argument("--workers", type=int, default=BULK_WORKERS, help="同時に処理する画像数")
+    parser.add_argument("--no-cache", action="store_true", help="結果キャッシュを使わない")
+    parser.add_argument("--no-index", action="store_true", help="アップロード一覧（/python/files）に登録しない")
+    args = parser.parse_args()
+
+    cache = None
+    if not args.no_cache:
+        cache = ResultCache(os.path.join(args.output_root, ".result_cache"))
+
+    index = None if args.no_index else get_upload_index(args.output_root)
+
+    items = (item for path in args.paths for item in iter_path(path))
+    failed = 0
+    for result in process_many(items, args.output_root, cache, args.workers, index):
+        if result["status"] == "error":
+            failed += 1
+        sys.stdout.write(json.dumps(result, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
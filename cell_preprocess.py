@@ -0,0 +1,107 @@
+import os
+import sys
+import threading
+
+import cv2
+import numpy as np
+
+# セル画像の前処理（店舗照合と OCR で共有）。
+# セルごとに一度だけ二値化し、セルの縁に残った表の罫線を取り除く。
+# 照合はこの二値画像をそのまま、OCR は内側を白黒反転して使う。
+# グレースケール化に使う中間バッファはスレッドごとに確保して使い回す
+# （セルの大きさは少しずつ違うので、最大の大きさで確保してその一部を使う）。
+LINE_REMOVAL = os.environ.get("TIMETABLE_LINE_REMOVAL", "1") == "1"
+BINARY_THRESHOLD = 127  # store_recognition.binarize と同じ
+LINE_MIN_RATIO = 0.5  # 罫線とみなす長さ（セルの幅・高さに対する割合）
+
+class CellPreprocessor:
+    """ 中間バッファを使い回してセル画像を二値化する """
+
+    def __init__(self, remove_lines=LINE_REMOVAL, line_min_ratio=LINE_MIN_RATIO):
+        self.remove_lines = remove_lines
+        self.line_min_ratio = line_min_ratio
+        self._local = threading.local()
+
+    def _gray_buffer(self, height, width):
+        """ height x width のビュー。足りなければ大きく確保し直す """
+        buffer = getattr(self._local, "gray", None)
+        if buffer is None or buffer.shape[0] < height or buffer.shape[1] < width:
+            h = max(height, buffer.shape[0] if buffer is not None else 0)
+            w = max(width, buffer.shape[1] if buffer is not None else 0)
+            buffer = np.empty((h, w), dtype=np.uint8)
+            self._local.gray = buffer
+        return buffer[:height, :width]
+
+    def binarize(self, image):
+        """
+        セル画像を二値化し（文字が白）、罫線を取り除く
+
+        :param image: カラーまたはグレースケールのセル画像
+        :return: 二値画像（新しい配列。中間バッファとは共有しない）
+        """
+        height, width = image.shape[:2]
+        if image.ndim == 3:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=self._gray_buffer(height, width))
+        else:
+            gray = image
+
+        binary = np.empty((height, width), dtype=np.uint8)
+        cv2.threshold(gray, BINARY_THRESHOLD, 255, cv2.THRESH_BINARY_INV, dst=binary)
+        if not self.remove_lines:
+            return binary
+
+        # セルの内側で line_min_ratio 以上続く横（縦）の白画素の並びを罫線として消す
+        # （横長・縦長のカーネルでのオープニングと同じ結果）。
+        # 白画素の数が足りない行（列）には罫線が無いので、射影で候補の範囲を絞ってから調べる
+        line_w = max(1, int(width * self.line_min_ratio))
+        line_h = max(1, int(height * self.line_min_ratio))
+        row_spans = _spans(cv2.reduce(binary, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32S).ravel() >= line_w * 255)
+        col_spans = _spans(cv2.reduce(binary, 0, cv2.REDUCE_SUM, dtype=cv2.CV_32S).ravel() >= line_h * 255)
+
+        # 両方向の罫線を求めてから消す（消した結果で次の方向を判定しない）
+        strips = [binary[y1:y2] for y1, y2 in row_spans] + [binary[:, x1:x2] for x1, x2 in col_spans]
+        ksizes = [(line_w, 1)] * len(row_spans) + [(1, line_h)] * len(col_spans)
+        masks = [_long_run_mask(strip, ksize) for strip, ksize in zip(strips, ksizes)]
+        for strip, mask in zip(strips, masks):
+            cv2.subtract(strip, mask, dst=strip)
+        return binary
+
+def _spans(mask):
+    """ True が続く区間 [(start, end), ...] """
+    if not mask.any():
+        return []
+    edges = np.flatnonzero(np.diff(mask.astype(np.int8), prepend=0, append=0))
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+def _long_run_mask(strip, ksize):
+    """
+    ksize の向きに ksize の長さ以上続く非 0 の画素を 255 にしたマスク
+
+    :param ksize: 横方向は (length, 1)、縦方向は (1, length)
+    """
+    kw, kh = ksize
+    ones = (strip > 0).astype(np.float32)
+    # その画素から始まる長さ length の区間がすべて非 0 か（区間の和はボックスフィルターで求める）
+    full = cv2.boxFilter(ones, -1, ksize, anchor=(0, 0), normalize=False, borderType=cv2.BORDER_CONSTANT)
+    starts = (full > kw * kh - 0.5).astype(np.float32)
+    # そのような区間のどれかに含まれる画素
+    covered = cv2.boxFilter(starts, -1, ksize, anchor=(kw - 1, kh - 1), normalize=False, borderType=cv2.BORDER_CONSTANT)
+    return cv2.compare(covered, 0.5, cv2.CMP_GT)
+
+_preprocessor = CellPreprocessor()
+
+def preprocess_cell(image):
+    """ 共有の CellPreprocessor でセル画像を二値化する（照合・OCR の入力） """
+    return _preprocessor.binarize(image)
+
+# デバッグ用：python cell_preprocess.py <cell_image> <output_image>
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python cell_preprocess.py <cell_image> <output_image>")
+        sys.exit(1)
+
+    image = cv2.imread(sys.argv[1])
+    if image is None:
+        print("Error: 画像を読み込めませんでした")
+        sys.exit(1)
+    cv2.imwrite(sys.argv[2], preprocess_cell(image))
@@ -0,0 +1,111 @@
+import os
+import sys
+import json
+import threading
+
+import cv2
+import numpy as np
+
+# 1 枚の表の header.jpeg とセル画像を 1 枚にまとめたコンタクトシート。
+# 表示側はこの 1 枚を CSS の background-position でセルごとに切り替えて表示するので、
+# セルの数だけ画像を取りに行く必要がない。
+# 出力ディレクトリに sheet_<タイルの大きさ>.jpeg として保存し、cells.json が新しくなったら作り直す。
+SHEET_NAME = "sheet_{tile}.jpeg"
+SHEET_TILE = int(os.environ.get("TIMETABLE_SHEET_TILE", "200"))  # セル 1 つの大きさ (px)
+SHEET_QUALITY = int(os.environ.get("TIMETABLE_SHEET_QUALITY", "85"))
+
+_lock = threading.Lock()
+
+def sheet_geometry(header_shape, columns, tile=SHEET_TILE):
+    """ (シートの幅, ヘッダーの高さ) ヘッダーは縦横比を保ってシートの幅に合わせる """
+    width = columns * tile
+    h, w = header_shape[:2]
+    return width, max(1, round(h * width / w))
+
+def make_contact_sheet(header, cells, rows, columns, tile=SHEET_TILE):
+    """
+    ヘッダーとセル画像を並べた画像を作る
+
+    :param cells: [(row, column, cell), ...]
+    :return: (画像, ヘッダーの高さ)
+    """
+    width, header_height = sheet_geometry(header.shape, columns, tile)
+    sheet = np.full((header_height + rows * tile, width, 3), 255, dtype=np.uint8)
+    sheet[:header_height] = _to_bgr(cv2.resize(header, (width, header_height), interpolation=cv2.INTER_AREA))
+
+    for r, c, cell in cells:
+        y = header_height + r * tile
+        x = c * tile
+        sheet[y:y + tile, x:x + tile] = _to_bgr(cv2.resize(cell, (tile, tile), interpolation=cv2.INTER_AREA))
+    return sheet, header_height
+
+def _to_bgr(image):
+    return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR) if image.ndim == 2 else image
+
+def get_contact_sheet(directory, rows, columns, cells_info, tile=SHEET_TILE):
+    """
+    出力ディレクトリのコンタクトシートのパスを返す。無い・cells.json より古い場合は作る
+
+    :param cells_info: cells.json の "cells"（セル画像のファイル名と位置）
+    :return: (パス, ヘッダーの高さ)
+    :raises FileNotFoundError: header.jpeg・セル画像が無い場合
+    """
+    path = os.path.join(directory, SHEET_NAME.format(tile=tile))
+    json_mtime = os.stat(os.path.join(directory, "cells.json")).st_mtime
+    header_path = os.path.join(directory, "header.jpeg")
+
+    with _lock:
+        try:
+            header_shape = _jpeg_shape(header_path)
+            if header_shape is not None and os.stat(path).st_mtime >= json_mtime:
+                return path, sheet_geometry(header_shape, columns, tile)[1]
+        except OSError:
+            pass
+
+        header = cv2.imread(header_path)
+        if header is None:
+            raise FileNotFoundError(header_path)
+        cells = []
+        for info in cells_info:
+            cell = cv2.imread(os.path.join(directory, info["filename"]))
+            if cell is None:
+                raise FileNotFoundError(os.path.join(directory, info["filename"]))
+            cells.append((info["row"], info["column"], cell))
+
+        sheet, header_height = make_contact_sheet(header, cells, rows, columns, tile)
+        ok, buf = cv2.imencode(".jpeg", sheet, [int(cv2.IMWRITE_JPEG_QUALITY), SHEET_QUALITY])
+        if not ok:
+            raise ValueError(f"Failed to encode contact sheet: {directory}")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(buf.tobytes())
+        os.replace(tmp_path, path)
+        return path, header_height
+
+def _jpeg_shape(path):
+    """ JPEG の (高さ, 幅) をヘッダー（SOF マーカー）だけから読む。読めなければ None """
+    with open(path, "rb") as f:
+        if f.read(2) != b"\xff\xd8":
+            return None
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            length = int.from_bytes(f.read(2), "big")
+            # SOF0〜SOF15（DHT・JPG・DAC を除く）
+            if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+                data = f.read(5)
+                return int.from_bytes(data[1:3], "big"), int.from_bytes(data[3:5], "big")
+            f.seek(length - 2, os.SEEK_CUR)
+
+# デバッグ用：python contact_sheet.py <output_dir>
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python contact_sheet.py <output_dir>")
+        sys.exit(1)
+
+    with open(os.path.join(sys.argv[1], "cells.json"), "r") as f:
+        cells_info = json.load(f)["cells"]
+    rows = max(info["row"] for info in cells_info) + 1
+    columns = max(info["column"] for info in cells_info) + 1
+    print(get_contact_sheet(sys.argv[1], rows, columns, cells_info))
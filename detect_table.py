@@ -1,6 +1,8 @@
 import cv2
 import numpy as np
 
+from metrics import timed
+
 def detect_table(image_path):
     """
     指定された画像から表の外枠を検出し、4点の座標を返す
@@ -9,7 +11,18 @@ def detect_table(image_path):
     """
     # 画像を読み込み（グレースケール）
     image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-    
+    if image is None:
+        raise ValueError(f"Error: 画像を読み込めませんでした ({image_path})")
+
+    return detect_table_image(image)
+
+@timed("detect_table")
+def detect_table_image(image):
+    """
+    デコード済みのグレースケール画像から表の外枠を検出し、4点の座標を返す
+    :param image: グレースケール画像 (ndarray)
+    :return: 矩形の座標リスト [x1, y1, x2, y2, x3, y3, x4, y4]
+    """
     # コントラストを上げるために前処理
     blurred = cv2.GaussianBlur(image, (5, 5), 0)
     _, thresh = cv2.threshold(blurred, 150, 255, cv2.THRESH_BINARY_INV)
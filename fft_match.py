@@ -0,0 +1,156 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# 周波数領域でのテンプレートマッチング（cv2.matchTemplate の TM_CCOEFF_NORMED と同じスコア）。
+# 正規化相互相関の分子は、平均を引いたテンプレートとセル画像の相互相関なので、
+# セル画像の DFT を 1 回だけ求め、テンプレートごとに保持しておいた DFT と掛けて逆変換する。
+# 分母（窓内の分散）はセル画像の積分画像から求める。
+# テンプレートの DFT はゼロ詰めした大きさ（セルの大きさで決まる）ごとに、照合するテンプレートの分だけ
+# 必要になった時に作る（候補を絞っていれば候補になったものだけ）。DFT は「テンプレート数 x 大きさの種類」
+# だけ増え、プロセスプールでは各ワーカーが別に持つため、合計が FFT_MAX_BYTES を超えたら
+# 最後に使われたのが古いものから捨てる（上限はワーカー 1 つあたり）。
+FFT_BLOCK = 32  # セルの大きさをこの倍数に切り上げてから DFT の大きさを決める（大きさの種類を減らす）
+FFT_MAX_BYTES = int(os.environ.get("TIMETABLE_FFT_MAX_BYTES", str(32 * 1024 * 1024)))
+
+def padded_shape(shape, block=FFT_BLOCK):
+    """ 大きさ shape のセル画像をゼロ詰めする DFT の大きさ """
+    h, w = shape[:2]
+    return (
+        cv2.getOptimalDFTSize(-(-h // block) * block),
+        cv2.getOptimalDFTSize(-(-w // block) * block)
+    )
+
+class TemplateSpectra:
+    """
+    テンプレート群の DFT とエネルギー（平均を引いた画素値の二乗和）を保持する
+
+    :param templates: [(filename, binary), ...]（TemplateBank.templates() の戻り値）
+    """
+
+    def __init__(self, templates, max_bytes=FFT_MAX_BYTES):
+        self.templates = templates
+        self.max_bytes = max_bytes
+        self.nbytes = 0  # 保持している DFT の合計バイト数
+        self._positions = {filename: i for i, (filename, _) in enumerate(templates)}
+        self._zero_mean = []
+        self._norms = []
+        for _, template in templates:
+            t = template.astype(np.float32)
+            t -= t.mean()
+            self._zero_mean.append(t)
+            self._norms.append(float(np.sqrt(np.square(t, dtype=np.float64).sum())))
+        self._lock = threading.Lock()
+        self._spectra = OrderedDict()  # (DFT の大きさ, templates での番号) -> DFT（LRU）
+
+    def position(self, filename, template):
+        """ templates での番号。このテンプレート群のものでなければ None """
+        i = self._positions.get(filename)
+        if i is None or self.templates[i][1] is not template:
+            return None
+        return i
+
+    def _spectrum(self, i, shape):
+        key = (shape, i)
+        with self._lock:
+            spectrum = self._spectra.get(key)
+            if spectrum is not None:
+                self._spectra.move_to_end(key)
+                return spectrum
+
+        # DFT はロックの外で求める（複数のスレッドが同時に作っても結果は同じ）
+        t = self._zero_mean[i]
+        padded = np.zeros(shape, dtype=np.float32)
+        padded[:t.shape[0], :t.shape[1]] = t
+        spectrum = cv2.dft(padded)
+        if spectrum.nbytes > self.max_bytes:
+            return spectrum  # 1 件でも上限を超える場合は保持しない
+
+        with self._lock:
+            previous = self._spectra.pop(key, None)
+            if previous is not None:
+                self.nbytes -= previous.nbytes
+            self._spectra[key] = spectrum
+            self.nbytes += spectrum.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._spectra.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return spectrum
+
+    def matcher(self, target_image):
+        """
+        ターゲット画像の DFT・積分画像を求め、テンプレートを 1 件ずつ照合する関数を返す
+
+        :return: match(i) -> (score, top_left)。i は templates での番号（ターゲットに収まるもの）
+        """
+        height, width = target_image.shape[:2]
+        shape = padded_shape(target_image.shape)
+        padded = np.zeros(shape, dtype=np.float32)
+        padded[:height, :width] = target_image
+        target_spectrum = cv2.dft(padded)
+        sums, square_sums = cv2.integral2(target_image, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+
+        def match(i):
+            h, w = self._zero_mean[i].shape
+            product = cv2.mulSpectrums(target_spectrum, self._spectrum(i, shape), 0, conjB=True)
+            correlation = cv2.idft(product, flags=cv2.DFT_SCALE | cv2.DFT_REAL_OUTPUT)
+            numerator = correlation[:height - h + 1, :width - w + 1]
+            denominator = _window_deviation(sums, square_sums, h, w) * np.float32(self._norms[i])
+            score = _normalize(numerator, denominator) if self._norms[i] > 0 else np.ones_like(numerator)
+            _, max_val, _, max_loc = cv2.minMaxLoc(score)
+            return max_val, max_loc
+
+        return match
+
+    def match(self, target_image, positions):
+        """
+        ターゲット画像を positions のテンプレートと照合する（DFT は 1 回だけ求める）
+
+        :param positions: templates での番号のリスト（ターゲットに収まるもの）
+        :return: [(score, top_left), ...]（positions と同じ順序）
+        """
+        match = self.matcher(target_image)
+        return [match(i) for i in positions]
+
+def _window_deviation(sums, square_sums, h, w):
+    """ h x w の各窓の sqrt(Σ(I - 窓の平均)^2)（float32） """
+    s1 = sums[h:, w:] - sums[:-h, w:]
+    s1 -= sums[h:, :-w]
+    s1 += sums[:-h, :-w]
+    s2 = square_sums[h:, w:] - square_sums[:-h, w:]
+    s2 -= square_sums[h:, :-w]
+    s2 += square_sums[:-h, :-w]
+    s1 *= s1
+    s1 *= 1.0 / (h * w)
+    s2 -= s1
+    np.maximum(s2, 0, out=s2)
+    return cv2.sqrt(s2.astype(np.float32))
+
+def _normalize(numerator, denominator):
+    """
+    matchTemplate と同じ規則で分子を分母で割る
+    （|分子| < 分母 なら割った値、分母の 1.125 倍未満なら ±1、それ以上・分母が 0 なら 0）
+    """
+    score = np.zeros_like(numerator)
+    np.divide(numerator, denominator, out=score, where=denominator > 0)
+    score[np.abs(score) >= 1.125] = 0
+    np.clip(score, -1, 1, out=score)
+    return score
+
+# デバッグ用：python fft_match.py <target_image> <template_image>  matchTemplate とのスコアの差を表示
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python fft_match.py <target_image> <template_image>")
+        sys.exit(1)
+
+    from store_recognition import binarize, preprocess_image, template_matching
+
+    target = preprocess_image(sys.argv[1])
+    template = binarize(cv2.imread(sys.argv[2], cv2.IMREAD_GRAYSCALE))
+    (score, top_left), = TemplateSpectra([(os.path.basename(sys.argv[2]), template)]).match(target, [0])
+    expected, expected_top_left, _ = template_matching(target, template)
+    print(f"fft={score:.6f} {top_left} matchTemplate={expected:.6f} {expected_top_left} diff={abs(score - expected):.2e}")
@@ -1,19 +1,33 @@
 import os
-from flask import Blueprint, render_template_string
+from flask import Blueprint, abort, request, render_template_string, send_file
+
+from thumbnails import ThumbnailCache
+from upload_index import get_upload_index, is_image
 
 files_bp = Blueprint('files', __name__)
 
 UPLOAD_FOLDER = "/var/www/html/opencv"
-ALLOWED_EXTENSIONS = {"jpg", "jpeg", "png", "gif"}
+PER_PAGE = 100
+MAX_PER_PAGE = 1000
+# サムネイルの URL には元画像の mtime (?v=) を付けるので、内容が変われば URL も変わる
+THUMBNAIL_MAX_AGE = 365 * 24 * 3600
+THUMBNAIL_MAX_AGE_UNVERSIONED = 3600
+
+thumbnail_cache = ThumbnailCache(UPLOAD_FOLDER)
 
 @files_bp.route("/python/files")
 def list_files():
+    page = max(1, request.args.get("page", 1, type=int))
+    per_page = min(max(1, request.args.get("per_page", PER_PAGE, type=int)), MAX_PER_PAGE)
+
+    # 一覧はアップロード時に登録されるインデックスから読む（フォルダは走査しない）
     try:
-        files = os.listdir(UPLOAD_FOLDER)
-        files = [f for f in files if f.split('.')[-1].lower() in ALLOWED_EXTENSIONS]
-        files.sort(key=lambda f: os.path.getmtime(os.path.join(UPLOAD_FOLDER, f)), reverse=True)
+        index = get_upload_index(UPLOAD_FOLDER)
+        total = index.count()  # 既存のファイルはインデックスを最初に開いたときに登録される
+        files = [(filename, int(mtime)) for filename, mtime, _ in index.page(page, per_page)]
     except Exception as e:
         return f"Error reading directory: {str(e)}"
+    pages = max(1, (total + per_page - 1) // per_page)
 
     return render_template_string("""
     <!DOCTYPE html>
@@ -35,17 +49,25 @@ def list_files():
             .clear {
                 clear: both;
             }
+            .pager {
+                margin: 10px;
+            }
         </style>
     </head>
     <body>
         <a href="/python/">Upload</a>
+        <div class="pager">
+            {% if page > 1 %}<a href="?page={{ page - 1 }}&per_page={{ per_page }}">&lt; 前へ</a>{% endif %}
+            {{ page }} / {{ pages }}（{{ total }} 件）
+            {% if page < pages %}<a href="?page={{ page + 1 }}&per_page={{ per_page }}">次へ &gt;</a>{% endif %}
+        </div>
         <div class="list">
-        {% for file in files %}
+        {% for file, mtime in files %}
             <div class="img_div">
                 <p class="img_name">{{ file }}</p>
  
-                <a href="../python/view_table?file={{ file.split('.')[0] }}">
-                    <img class="img" src="../opencv/{{ file }}" alt="{{ file }}">
+                <a href="../python/view_table?file={{ file.split('.')[0] }}&mode=sheet">
+                    <img class="img" src="../python/thumbnail/{{ file }}?v={{ mtime }}" alt="{{ file }}" loading="lazy">
                 </a>
             </div>
         {% endfor %}
@@ -53,5 +75,23 @@ def list_files():
         </div>
     </body>
     </html>
-    """, files=files)
+    """, files=files, page=page, pages=pages, per_page=per_page, total=total)
+
+
+@files_bp.route("/python/thumbnail/<filename>")
+def thumbnail(filename):
+    if os.path.basename(filename) != filename or not is_image(filename):
+        abort(404)
+    try:
+        path = thumbnail_cache.get(filename)
+    except FileNotFoundError:
+        abort(404)
+    except ValueError:
+        abort(415)
 
+    max_age = THUMBNAIL_MAX_AGE if request.args.get("v") else THUMBNAIL_MAX_AGE_UNVERSIONED
+    response = send_file(path, mimetype="image/jpeg", conditional=True, etag=True, max_age=max_age)
+    response.cache_control.public = True
+    if request.args.get("v"):
+        response.cache_control.immutable = True
+    return response
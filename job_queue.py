@@ -0,0 +1,114 @@
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+# split_table をリクエストスレッドの外で実行するためのジョブキュー。
+# ジョブ ID は画像の md5 で、処理中の同じ画像の二重投入は既存のジョブにまとめる。
+# 同時実行数は Web ワーカー数とは別に TIMETABLE_JOB_WORKERS で調整する。
+JOB_WORKERS = int(os.environ.get("TIMETABLE_JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.environ.get("TIMETABLE_JOB_QUEUE_SIZE", "32"))
+JOB_HISTORY_SIZE = int(os.environ.get("TIMETABLE_JOB_HISTORY_SIZE", "1000"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+
+class QueueFull(Exception):
+    """ キューが上限に達していて新しいジョブを受け付けられない """
+
+class JobQueue:
+    """ 上限付きのローカルワーカーキュー """
+
+    def __init__(self, func, workers=JOB_WORKERS, queue_size=JOB_QUEUE_SIZE, history_size=JOB_HISTORY_SIZE):
+        """
+        :param func: ジョブ本体 func(*args) の戻り値が result になる
+        :param workers: 同時に実行するワーカースレッド数
+        :param queue_size: 待機できるジョブ数の上限（超えると QueueFull）
+        :param history_size: 保持する完了済みジョブ数の上限
+        """
+        self.func = func
+        self.history_size = history_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._jobs = OrderedDict()  # job_id -> dict
+        self._lock = threading.Lock()
+        self._threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, job_id, *args):
+        """
+        ジョブを投入して状態を返す。同じ job_id が待機中・実行中ならそれを返す
+        （完了済みのジョブは投入し直す。結果キャッシュがあればすぐに終わる）
+
+        :raises QueueFull: キューが満杯の場合
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job["status"] in (QUEUED, RUNNING):
+                return self._public(job)
+
+            job = {"id": job_id, "status": QUEUED, "submitted": time.time(),
+                   "started": None, "finished": None, "result": None, "error": None}
+            try:
+                self._queue.put_nowait((job, args))
+            except queue.Full:
+                raise QueueFull(f"job queue is full ({self._queue.maxsize})")
+            self._jobs[job_id] = job
+            self._jobs.move_to_end(job_id)
+            self._trim()
+            return self._public(job)
+
+    def status(self, job_id):
+        """ ジョブの状態を返す。不明な job_id は None """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._public(job) if job is not None else None
+
+    def stats(self):
+        """ キューの混雑状況 """
+        with self._lock:
+            counts = {QUEUED: 0, RUNNING: 0, DONE: 0, ERROR: 0}
+            for job in self._jobs.values():
+                counts[job["status"]] += 1
+        counts["queue_size"] = self._queue.maxsize
+        counts["workers"] = len(self._threads)
+        return counts
+
+    def _worker(self):
+        while True:
+            job, args = self._queue.get()
+            with self._lock:
+                job["status"] = RUNNING
+                job["started"] = time.time()
+            result, error = None, None
+            try:
+                result = self.func(*args)
+            except Exception as e:
+                error = str(e)
+            with self._lock:
+                job["result"] = result
+                job["error"] = error
+                job["status"] = ERROR if error is not None else DONE
+                job["finished"] = time.time()
+            self._queue.task_done()
+
+    def _trim(self):
+        # 古い完了済みジョブから削除（待機中・実行中は残す）
+        excess = len(self._jobs) - self.history_size
+        if excess <= 0:
+            return
+        for job_id in list(self._jobs):
+            if excess <= 0:
+                break
+            if self._jobs[job_id]["status"] in (DONE, ERROR):
+                del self._jobs[job_id]
+                excess -= 1
+
+    @staticmethod
+    def _public(job):
+        return dict(job)
@@ -0,0 +1,198 @@
+import os
+import sys
+import json
+import hashlib
+import threading
+
+# 時刻表の様式（行数・各行の列の区切り）の定義。
+# layouts/ ディレクトリの JSON ファイル 1 つが 1 様式で、読み込み時に一度だけ
+# 正規化した区切り位置（0〜1）に変換しておく。様式ごとにコードを分岐させる必要はない。
+#
+# {
+#     "name": "timetable_7x5",            # 省略時はファイル名
+#     "description": "...",
+#     "rows": 7,                           # 行数（row_ratios を書く場合は省略可）
+#     "row_ratios": [0.15, 0.3, ...],      # 行の区切り（省略時は等分）
+#     "columns": 5,                        # 全行共通の列数（等分）
+#     "col_ratios": [[0.2, 0.4, ...], ...] # 行ごとの列の区切り（columns の代わり）
+#     "aspect_ratio": 1.36,                # 表の縦横比（高さ / 幅）の目安。自動選択に使う
+#     "aspect_tolerance": 0.15             # 縦横比の許容誤差（割合）
+# }
+LAYOUT_DIR = os.environ.get("TIMETABLE_LAYOUT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "layouts"))
+# 使う様式の名前。"auto" の場合は表の縦横比と罫線から自動で選ぶ
+LAYOUT = os.environ.get("TIMETABLE_LAYOUT", "auto")
+DEFAULT_LAYOUT = "timetable_7x5"
+DEFAULT_ASPECT_TOLERANCE = 0.15
+
+class Layout:
+    """ 読み込み済みの様式。区切り位置は表の幅・高さに対する割合で持つ """
+
+    def __init__(self, name, row_edges, col_edges, aspect_ratio=None, aspect_tolerance=DEFAULT_ASPECT_TOLERANCE,
+                 description="", uniform_rows=False):
+        self.name = name
+        self.description = description
+        self.row_edges = row_edges  # [0, ..., 1]（行数 + 1 個）
+        self.uniform_rows = uniform_rows  # 等分の場合は従来どおり int(height / rows) 刻み
+        self.col_edges = col_edges  # 行ごとの [0, ..., 1]
+        self.aspect_ratio = aspect_ratio
+        self.aspect_tolerance = aspect_tolerance
+
+    @property
+    def rows(self):
+        return len(self.row_edges) - 1
+
+    @property
+    def columns(self):
+        """ 最も列の多い行の列数 """
+        return max(len(edges) - 1 for edges in self.col_edges)
+
+    @property
+    def cell_count(self):
+        return sum(len(edges) - 1 for edges in self.col_edges)
+
+    @classmethod
+    def from_dict(cls, data, name=None):
+        """
+        JSON の定義から Layout を作る
+
+        :raises ValueError: 定義が不正な場合
+        """
+        name = data.get("name", name)
+        if not name:
+            raise ValueError("Layout name is missing")
+
+        if "row_ratios" in data:
+            row_edges = [0.0] + [float(v) for v in data["row_ratios"]] + [1.0]
+        elif int(data.get("rows", 0)) > 0:
+            row_edges = None  # 等分
+        else:
+            raise ValueError(f"{name}: rows or row_ratios is required")
+        rows = len(row_edges) - 1 if row_edges else int(data["rows"])
+
+        if "col_ratios" in data:
+            col_ratios = data["col_ratios"]
+            if len(col_ratios) != rows:
+                raise ValueError(f"{name}: col_ratios must have {rows} rows")
+            col_edges = [[0.0] + [float(v) for v in ratios] + [1.0] for ratios in col_ratios]
+        elif int(data.get("columns", 0)) > 0:
+            columns = int(data["columns"])
+            col_edges = [[i / columns for i in range(columns + 1)] for _ in range(rows)]
+        else:
+            raise ValueError(f"{name}: columns or col_ratios is required")
+
+        for edges in ([row_edges] if row_edges else []) + col_edges:
+            if any(b <= a for a, b in zip(edges, edges[1:])):
+                raise ValueError(f"{name}: ratios must be increasing between 0 and 1")
+
+        return cls(
+            name, row_edges or [r / rows for r in range(rows + 1)], col_edges,
+            data.get("aspect_ratio"), float(data.get("aspect_tolerance", DEFAULT_ASPECT_TOLERANCE)),
+            data.get("description", ""), uniform_rows=row_edges is None
+        )
+
+    def cell_rects(self, width, height):
+        """ 射影変換後の表（width x height）でのセル矩形 [(row, column, x1, y1, x2, y2), ...] を返す """
+        if self.uniform_rows:
+            row_height = int(height / self.rows)
+            row_positions = [r * row_height for r in range(self.rows + 1)]
+        else:
+            row_positions = [int(height * ratio) for ratio in self.row_edges[:-1]] + [int(height)]
+
+        rects = []
+        for r in range(self.rows):
+            col_ratios = self.col_edges[r][1:-1]
+            col_positions = [0] + [int(width * ratio) for ratio in col_ratios] + [int(width)]
+            for c in range(len(col_positions) - 1):
+                rects.append((r, c, col_positions[c], row_positions[r], col_positions[c + 1], row_positions[r + 1]))
+        return rects
+
+    def config(self):
+        """ 解析結果に影響する定義（フィンガープリント用） """
+        return {"name": self.name, "row_edges": self.row_edges, "col_edges": self.col_edges, "uniform_rows": self.uniform_rows}
+
+    def __repr__(self):
+        return f"Layout({self.name!r}, rows={self.rows}, columns={self.columns})"
+
+
+class LayoutRegistry:
+    """
+    様式の定義ファイルを読み込んで保持する。
+    ディレクトリの mtime やファイル構成が変わった場合は自動で読み込み直す（TemplateBank と同様）。
+    """
+
+    def __init__(self, directory_path=LAYOUT_DIR):
+        self.directory_path = directory_path
+        self._lock = threading.Lock()
+        self._signature = None
+        self._layouts = {}
+
+    def _scan(self):
+        entries = []
+        with os.scandir(self.directory_path) as it:
+            for entry in it:
+                if not entry.name.lower().endswith(".json"):
+                    continue
+                st = entry.stat()
+                entries.append((entry.name, st.st_mtime_ns, st.st_size))
+        entries.sort()
+        return (os.stat(self.directory_path).st_mtime_ns, tuple(entries))
+
+    def _load(self, signature):
+        layouts = {}
+        for filename, _, _ in signature[1]:
+            with open(os.path.join(self.directory_path, filename), "r") as f:
+                layout = Layout.from_dict(json.load(f), os.path.splitext(filename)[0])
+            if layout.name in layouts:
+                raise ValueError(f"Duplicate layout name: {layout.name}")
+            layouts[layout.name] = layout
+        return layouts
+
+    def layouts(self):
+        """ {name: Layout} を返す """
+        signature = self._scan()
+        if signature != self._signature:
+            with self._lock:
+                if signature != self._signature:
+                    self._layouts = self._load(signature)
+                    self._signature = signature
+        return self._layouts
+
+    def get(self, name=DEFAULT_LAYOUT):
+        """ :raises KeyError: 指定した様式が無い場合 """
+        layouts = self.layouts()
+        if name not in layouts:
+            raise KeyError(f"Unknown layout: {name}")
+        return layouts[name]
+
+    def fingerprint(self):
+        """ 定義の内容を表すハッシュ値（定義が変われば変わる） """
+        config = [layout.config() for _, layout in sorted(self.layouts().items())]
+        return hashlib.md5(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+def get_layout_registry(directory_path=LAYOUT_DIR):
+    """ ディレクトリごとに共有される LayoutRegistry を取得 """
+    key = os.path.abspath(directory_path)
+    with _registries_lock:
+        registry = _registries.get(key)
+        if registry is None:
+            registry = LayoutRegistry(directory_path)
+            _registries[key] = registry
+    return registry
+
+def get_layout(name=None):
+    """ 名前で様式を取得（省略時は既定の様式） """
+    return get_layout_registry().get(name or DEFAULT_LAYOUT)
+
+# デバッグ用：定義ファイルの検証と一覧
+if __name__ == "__main__":
+    directory = sys.argv[1] if len(sys.argv) > 1 else LAYOUT_DIR
+    try:
+        for name, layout in sorted(LayoutRegistry(directory).layouts().items()):
+            print(f"{name}\trows={layout.rows}\tcolumns={layout.columns}\taspect={layout.aspect_ratio}\t{layout.description}")
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
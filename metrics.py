@@ -0,0 +1,174 @@
+import os
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# 処理時間・件数の計測と、Prometheus のテキスト形式での出力。
+# 値はプロセスごとに保持する（Web ワーカーが複数ある場合はワーカーごとの値になる）。
+# ステージの処理時間はヒストグラムに記録し、collect_timings() の中ではリクエストごとの合計も集める。
+METRICS_ENABLED = os.environ.get("TIMETABLE_METRICS", "1") == "1"
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STAGE_SECONDS = "timetable_stage_seconds"
+TEMPLATE_MATCHES = "timetable_template_matches_total"
+RESULT_CACHE = "timetable_result_cache_total"
+BYTES_WRITTEN = "timetable_bytes_written_total"
+OCR_CELLS = "timetable_ocr_cells_total"
+INDEX_LOOKUPS = "timetable_template_index_lookups_total"
+
+# name -> (type, help)
+_DESCRIPTIONS = {
+    STAGE_SECONDS: ("histogram", "Time spent in each pipeline stage"),
+    TEMPLATE_MATCHES: ("counter", "Number of template comparisons against store templates (skipped: cut by early exit)"),
+    RESULT_CACHE: ("counter", "Result cache lookups in store_upload"),
+    BYTES_WRITTEN: ("counter", "Bytes written to the output directory"),
+    OCR_CELLS: ("counter", "Number of cells passed to the OCR engine pool"),
+    INDEX_LOOKUPS: ("counter", "Template index lookups (fallback: no features, coarse shortlist used)")
+}
+
+# collect_timings() の中で有効な {stage: 秒} （リクエストごと）
+# workers.map_ordered のスレッドにも引き継がれ、複数のスレッドから加算されるためロックで守る
+_timings = contextvars.ContextVar("timetable_timings", default=None)
+_timings_lock = threading.Lock()
+
+class Histogram:
+    """ 累積バケットのヒストグラム（Prometheus の histogram と同じ） """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+class Registry:
+    """ カウンターとヒストグラムを名前・ラベルごとに保持する """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}    # (name, labels) -> 値
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._collectors = []  # 出力時に値を返す関数（キャッシュの統計など）
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def add_collector(self, collector):
+        """
+        出力時に呼ばれる関数を登録する
+
+        :param collector: collector() -> [(name, type, help, [(labels_dict, value), ...]), ...]
+        """
+        self._collectors.append(collector)
+
+    def render(self):
+        """ Prometheus のテキスト形式 (version 0.0.4) """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, (h.buckets, list(h.counts), h.sum, h.count)) for key, h in self._histograms.items()
+            )
+
+        lines = []
+        described = set()
+
+        def describe(name, metric_type=None, help_text=None):
+            if name in described:
+                return
+            described.add(name)
+            default_type, default_help = _DESCRIPTIONS.get(name, ("untyped", ""))
+            lines.append(f"# HELP {name} {help_text or default_help}")
+            lines.append(f"# TYPE {name} {metric_type or default_type}")
+
+        for (name, labels), value in counters:
+            describe(name)
+            lines.append(f"{name}{_labels(labels)} {_value(value)}")
+
+        for (name, labels), (buckets, counts, total, count) in histograms:
+            describe(name)
+            cumulative = 0
+            for bound, n in zip(buckets, counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{_labels(labels + (('le', _value(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {_value(total)}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+
+        for collector in self._collectors:
+            for name, metric_type, help_text, samples in collector():
+                describe(name, metric_type, help_text)
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(tuple(sorted(labels.items())))} {_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+def _value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+registry = Registry()
+
+def inc(name, value=1, **labels):
+    if METRICS_ENABLED:
+        registry.inc(name, value, **labels)
+
+@contextmanager
+def timed(stage):
+    """ with ブロックの処理時間をステージ stage として記録する """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if METRICS_ENABLED:
+            registry.observe(STAGE_SECONDS, elapsed, stage=stage)
+        timings = _timings.get()
+        if timings is not None:
+            with _timings_lock:
+                timings[stage] = timings.get(stage, 0.0) + elapsed
+
+@contextmanager
+def collect_timings():
+    """
+    with ブロック内で timed() が記録したステージごとの合計秒数を集める
+    （同じスレッドと、workers.map_ordered がスレッドで実行した処理の分。並列に動いた分も合計する）
+
+    :return: {stage: 秒}（ブロックを抜けた後に値が入っている）
+    """
+    timings = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+def render():
+    return registry.render()
@@ -0,0 +1,162 @@
+import os
+import sys
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from metrics import OCR_CELLS, inc, timed
+from cell_preprocess import preprocess_cell
+from split_table import CELL_MARGIN_H, CELL_MARGIN_W
+
+# セル単位の OCR。
+# tesserocr の PyTessBaseAPI を常駐させ（jpn の traineddata は起動時に一度だけ読む）、
+# 複数のエンジンをプールしてスレッドから使い回す。Recognize 中は GIL が解放されるので
+# スレッドで並列に動く。pytesseract のように画像ごとに tesseract を起動しない。
+# 既定では無効（TIMETABLE_OCR=1 で有効。tesserocr が必要）。
+# tesserocr が無い・エンジンを初期化できない（tessdata が無いなど）場合は OCR せずに結果を返す
+OCR_ENABLED = os.environ.get("TIMETABLE_OCR", "0") == "1"
+OCR_LANG = os.environ.get("TIMETABLE_OCR_LANG", "jpn")
+OCR_PSM = int(os.environ.get("TIMETABLE_OCR_PSM", "7"))  # 7: 1 行のテキスト（セルの店舗名）
+OCR_WORKERS = int(os.environ.get("TIMETABLE_OCR_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+TESSDATA_PREFIX = os.environ.get("TESSDATA_PREFIX", "/usr/share/tesseract-ocr/5/tessdata")
+
+class OcrPool:
+    """
+    常駐する Tesseract エンジンのプール
+
+    作成時にエンジンを 1 つ作り、初期化できることを確かめる（残りは必要になった時に作る）。
+
+    :raises ImportError: tesserocr がインストールされていない場合
+    :raises RuntimeError: エンジンを初期化できない場合（tessdata・言語データが無いなど）
+    """
+
+    def __init__(self, size=OCR_WORKERS, lang=OCR_LANG, psm=OCR_PSM, tessdata=TESSDATA_PREFIX):
+        import tesserocr
+
+        self._tesserocr = tesserocr
+        self.size = max(1, size)
+        self.lang = lang
+        self.psm = psm
+        self.tessdata = tessdata
+        self._engines = queue.Queue()
+        self._all = []
+        self._lock = threading.Lock()
+        self._engines.put(self._create_engine())
+        self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="ocr")
+
+    def _create_engine(self):
+        engine = self._tesserocr.PyTessBaseAPI(path=self.tessdata, lang=self.lang, psm=self.psm)
+        self._all.append(engine)
+        return engine
+
+    def _acquire(self):
+        """ 空いているエンジンを取り出す（上限までは必要になった時に作る） """
+        try:
+            return self._engines.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._all) < self.size:
+                return self._create_engine()
+        return self._engines.get()
+
+    def _recognize_one(self, image, psm):
+        engine = self._acquire()
+        try:
+            engine.SetPageSegMode(self.psm if psm is None else psm)
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+            image = image if image.flags["C_CONTIGUOUS"] else image.copy()
+            h, w = image.shape
+            engine.SetImageBytes(image.tobytes(), w, h, 1, w)
+            text = engine.GetUTF8Text().strip()
+            return text, engine.MeanTextConf()
+        finally:
+            engine.Clear()
+            self._engines.put(engine)
+
+    def recognize(self, images, psm=None):
+        """
+        画像（グレースケールまたはカラー）をまとめて OCR する
+
+        :return: [(text, confidence), ...]（入力と同じ順序。confidence は 0〜100）
+        """
+        if len(images) <= 1:
+            return [self._recognize_one(image, psm) for image in images]
+        return list(self._executor.map(lambda image: self._recognize_one(image, psm), images))
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for engine in self._all:
+                engine.End()
+            self._all.clear()
+        self._engines = queue.Queue()
+
+
+_pool = None
+_pool_error = None  # OcrPool を作れなかった時の例外（毎回作り直さない）
+_pool_lock = threading.Lock()
+
+def get_ocr_pool():
+    """
+    プロセス内で共有される OcrPool を取得
+
+    :raises ImportError: tesserocr がインストールされていない場合
+    :raises RuntimeError: エンジンを初期化できない場合
+    """
+    global _pool, _pool_error
+    with _pool_lock:
+        if _pool_error is not None:
+            raise _pool_error
+        if _pool is None:
+            try:
+                _pool = OcrPool()
+            except (ImportError, RuntimeError) as e:
+                _pool_error = e
+                raise
+    return _pool
+
+def ocr_target(binary):
+    """ preprocess_cell の二値画像から OCR 用の画像を作る（セルの内側を使い、黒文字・白背景にする） """
+    height, width = binary.shape[:2]
+    margin_h = int(height * CELL_MARGIN_H)
+    margin_w = int(width * CELL_MARGIN_W)
+    return cv2.bitwise_not(binary[margin_h:height - margin_h, margin_w:width - margin_w])
+
+@timed("ocr")
+def ocr_cells(cells, cells_info, targets=None):
+    """
+    classify_cell で "text" と判定されたセルだけを OCR し、cells_info の各要素に
+    "text"（読み取った文字列）と "text_confidence" を追加する。
+    OCR エンジンを使えない場合（get_ocr_pool が失敗した場合）は何も追加しない
+
+    :param cells: [(row, column, cell_image), ...]
+    :param cells_info: cells と同じ順序の cells_info（書き換える）
+    :param targets: 照合で使った preprocess_cell 済みの二値画像（省略時・None の要素はここで求める）
+    """
+    try:
+        pool = get_ocr_pool()
+    except (ImportError, RuntimeError):
+        return cells_info
+    if targets is None:
+        targets = [None] * len(cells)
+    text_cells = [i for i, info in enumerate(cells_info) if info["type"] == "text"]
+    binaries = [targets[i] if targets[i] is not None else preprocess_cell(cells[i][2]) for i in text_cells]
+    results = pool.recognize([ocr_target(binary) for binary in binaries])
+    inc(OCR_CELLS, len(text_cells))
+    for i, (text, confidence) in zip(text_cells, results):
+        cells_info[i]["text"] = text
+        cells_info[i]["text_confidence"] = confidence
+    return cells_info
+
+# デバッグ用：python ocr_pool.py <cell_image> [<cell_image> ...]
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python ocr_pool.py <cell_image> [<cell_image> ...]")
+        sys.exit(1)
+
+    images = [ocr_target(preprocess_cell(cv2.imread(path))) for path in sys.argv[1:]]
+    for path, (text, confidence) in zip(sys.argv[1:], get_ocr_pool().recognize(images)):
+        print(f"{path}\t{confidence}\t{text}")
@@ -1,9 +1,10 @@
 import cv2
-import numpy as np
-import pytesseract
 import argparse
 import os
 
+from cell_preprocess import preprocess_cell
+from ocr_pool import ocr_target
+
 # 環境変数を設定（Tesseractが日本語を正しく認識できるようにする）
 os.environ["TESSDATA_PREFIX"] = "/usr/share/tesseract-ocr/5/tessdata"
 
@@ -15,26 +16,26 @@ def preprocess_image(image_path):
     # グレースケール変換
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
-    # 罫線を薄くするためのぼかし
-    blurred = cv2.GaussianBlur(gray, (3, 3), 0)
-
-    # 二値化（適応的閾値）で文字を強調
-    binary = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 11, 2)
-
-    # 罫線をぼかして除去（メディアンフィルタ）
-    binary = cv2.medianBlur(binary, 5)
-
-    # 文字を強調するための処理（膨張・収縮）
-    kernel = np.ones((2,2), np.uint8)
-    binary = cv2.dilate(binary, kernel, iterations=1)
-    binary = cv2.erode(binary, kernel, iterations=1)
+    return preprocess(gray)
 
-    return binary
+def preprocess(gray):
+    """
+    グレースケール画像 (ndarray) をパイプラインの OCR と同じ処理で OCR 用の画像にする
+    （preprocess_cell で二値化して罫線を除き、ocr_target で内側を黒文字・白背景にする）
+    """
+    return ocr_target(preprocess_cell(gray))
 
 def perform_ocr(image):
     """OCRを実行し、読み取った文字列を返す"""
-    text = pytesseract.image_to_string(image, lang="jpn", config="--psm 6")
-    return text
+    # tesserocr があれば常駐のエンジンを使う（画像ごとに tesseract を起動しない）
+    # tesserocr が無い・エンジンを初期化できない場合は pytesseract を使う
+    try:
+        from ocr_pool import get_ocr_pool
+        pool = get_ocr_pool()
+    except (ImportError, RuntimeError):
+        import pytesseract
+        return pytesseract.image_to_string(image, lang="jpn", config="--psm 6")
+    return pool.recognize([image], psm=6)[0][0]
 
 def main():
     # 引数の設定
@@ -0,0 +1,123 @@
+import os
+import sys
+import cv2
+import numpy as np
+
+from metrics import timed
+
+# 横向き・逆さまに撮影された画像の向きを判定する。
+# 縮小したグレースケール画像から表の外枠・罫線・ヘッダーの位置を一度だけ調べ、
+# 0/90/180/270 度（時計回り）の各候補を採点する。
+# 正しい向きでは：表が縦長で、横罫線（8本）が縦罫線（6本）より多く、ヘッダーの書き込みが表の上にある。
+AUTO_ORIENT = os.environ.get("TIMETABLE_AUTO_ORIENT", "1") == "1"
+ORIENTATION_MAX_SIDE = 800
+ANGLES = (0, 90, 180, 270)
+
+_ROTATE_CODES = {
+    90: cv2.ROTATE_90_CLOCKWISE,
+    180: cv2.ROTATE_180,
+    270: cv2.ROTATE_90_COUNTERCLOCKWISE
+}
+
+def rotate(image, angle):
+    """ 画像を時計回りに angle 度回転する（rotate.py と同じ向き） """
+    if angle == 0:
+        return image
+    return cv2.rotate(image, _ROTATE_CODES[angle])
+
+def _count_lines(profile, length):
+    """ 射影プロファイルで、長さの半分以上続く罫線の本数を数える """
+    on = profile > length * 0.5
+    return int(np.count_nonzero(on[1:] & ~on[:-1]) + on[0]) if on.size else 0
+
+def orientation_features(gray):
+    """
+    向きの判定に使う特徴量を求める
+
+    :param gray: グレースケール画像（縮小済みを想定）
+    :return: dict または表の外枠が見つからない場合 None
+    """
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    _, binary = cv2.threshold(blurred, 150, 1, cv2.THRESH_BINARY_INV)
+
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    x, y, w, h = cv2.boundingRect(max(contours, key=cv2.contourArea))
+    if w < 10 or h < 10:
+        return None
+
+    # 外枠内の罫線だけを取り出して本数を数える（横罫線は行方向、縦罫線は列方向の射影）
+    frame = binary[y:y + h, x:x + w]
+    horizontal = cv2.morphologyEx(frame, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (w // 2, 1)))
+    vertical = cv2.morphologyEx(frame, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, h // 2)))
+
+    return {
+        "frame": (x, y, w, h),
+        "horizontal_lines": _count_lines(horizontal.sum(axis=1), w),
+        "vertical_lines": _count_lines(vertical.sum(axis=0), h),
+        # 外枠の上下左右にある書き込みの量
+        "ink": {
+            "top": int(binary[:y, x:x + w].sum()),
+            "bottom": int(binary[y + h:, x:x + w].sum()),
+            "left": int(binary[y:y + h, :x].sum()),
+            "right": int(binary[y:y + h, x + w:].sum())
+        }
+    }
+
+def score_orientations(features):
+    """ 各候補角度のスコアを返す {angle: score}（大きいほど正しい向きらしい） """
+    _, _, w, h = features["frame"]
+    n_h, n_v = features["horizontal_lines"], features["vertical_lines"]
+    ink = features["ink"]
+
+    # 時計回りに回転したとき、上側に来る元画像の辺
+    top_side = {0: "top", 90: "left", 180: "bottom", 270: "right"}
+    bottom_side = {0: "bottom", 90: "right", 180: "top", 270: "left"}
+
+    scores = {}
+    for angle in ANGLES:
+        sideways = angle in (90, 270)
+        rw, rh = (h, w) if sideways else (w, h)
+        rn_h, rn_v = (n_v, n_h) if sideways else (n_h, n_v)
+
+        aspect = float(np.clip((rh / rw - 1) * 4, -1, 1))
+        lines = (rn_h - rn_v) / (rn_h + rn_v) if rn_h + rn_v else 0.0
+        above, below = ink[top_side[angle]], ink[bottom_side[angle]]
+        header = (above - below) / (above + below) if above + below else 0.0
+
+        scores[angle] = aspect + lines + header
+    return scores
+
+@timed("orientation")
+def detect_orientation(image):
+    """
+    画像を正しい向きにするための回転角（時計回り、0/90/180/270）を返す
+
+    :param image: カラーまたはグレースケール画像
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    scale = min(1.0, ORIENTATION_MAX_SIDE / max(gray.shape[:2]))
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    features = orientation_features(gray)
+    if features is None:
+        return 0
+
+    scores = score_orientations(features)
+    # 同点の場合は 0 度（回転なし）を優先
+    return max(ANGLES, key=lambda angle: (scores[angle], angle == 0))
+
+# デバッグ用
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python orientation.py <image_path> [<image_path> ...]")
+        sys.exit(1)
+
+    for path in sys.argv[1:]:
+        image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            print(f"{path}\tError: 画像を読み込めませんでした")
+            continue
+        print(f"{path}\t{detect_orientation(image)}")
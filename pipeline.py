@@ -0,0 +1,199 @@
+import cv2
+import numpy as np
+import os
+import hashlib
+import json
+import sys
+
+from detect_table import detect_table_image
+from split_table import (
+    GRID_MODE, OUTPUT_ROOT, analyze_cells, classify_cells, cut_cells, extract_grid, select_layout,
+    write_cells
+)
+from store_recognition import (
+    COARSE_SCALE, INDEX_SCALE, MATCH_ACCEPT, MATCH_INDEX, MATCH_KEEP, MATCH_MARGIN, MATCH_METHOD, MATCH_TOP_K,
+    STORE_TEMPLATE_DIR, get_template_bank
+)
+from result_cache import make_key
+from orientation import AUTO_ORIENT, detect_orientation, rotate
+from layouts import LAYOUT, get_layout_registry
+from metrics import BYTES_WRITTEN, RESULT_CACHE, inc, timed
+from ocr_pool import OCR_ENABLED, OCR_LANG, OCR_PSM, ocr_cells
+from cell_preprocess import LINE_MIN_RATIO, LINE_REMOVAL, preprocess_cell
+
+# アップロードされた画像をメモリ上だけで処理するパイプライン。
+# バイト列を cv2.imdecode で一度だけデコードし、
+# 表検出 → セル切り出し → セル分類 → 店舗照合 まで ndarray のまま受け渡す。
+# JPEG への書き出しは最後の出力ステージ (write_result) でのみ行う。
+
+@timed("decode")
+def decode_image(file_data):
+    """ アップロードされたバイト列をカラー画像 (ndarray) にデコード """
+    np_arr = np.frombuffer(file_data, np.uint8)
+    image = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("画像を読み込めません")
+    return image
+
+@timed("pipeline")
+def run_pipeline(image, file_hash, store_template_dir=STORE_TEMPLATE_DIR, backend=None, top_k=None, auto_orient=None, layout=None, ocr=None):
+    """
+    デコード済みのカラー画像に対して表検出〜店舗照合までを実行する
+
+    :param image: カラー画像 (ndarray)
+    :param file_hash: 元画像の md5
+    :param backend: セル解析の実行方式（workers.EXECUTOR_BACKEND）
+    :param top_k: 粗密探索で原寸照合するテンプレート数（省略時は MATCH_TOP_K、0 以下で全探索）
+    :param auto_orient: 向きを自動で補正するか（省略時は orientation.AUTO_ORIENT）
+    :param layout: 様式の名前または "auto"（省略時は layouts.LAYOUT）
+    :param ocr: "text" のセルを OCR して cells_info に "text" を追加するか（省略時は ocr_pool.OCR_ENABLED）
+    :return: {"md5", "rotation", "table_coords", "layout", "header", "cells", "cells_info"} の dict
+    """
+    if auto_orient is None:
+        auto_orient = AUTO_ORIENT
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    # 横向き・逆さまの画像は、表検出の前に一度だけ回転する
+    rotation = 0
+    if auto_orient:
+        rotation = detect_orientation(gray)
+        image = rotate(image, rotation)
+        gray = rotate(gray, rotation)
+
+    table_coords = detect_table_image(gray)
+
+    # 様式を選び、セルの区切りを実際の罫線に合わせる
+    layout = select_layout(table_coords, gray, layout)
+    rects = extract_grid(gray, table_coords, layout) if GRID_MODE == "lines" else None
+
+    # 各セルを射影変換で最終サイズに直接切り出す（CellGrid）
+    header, cells = cut_cells(image, table_coords, layout, rects)
+
+    # 空欄判定は切り出したセルごとに行う
+    classes = classify_cells(cells)
+    # 文字のあるセルは一度だけ二値化・罫線を除去し、照合と OCR の両方で使う
+    targets = [preprocess_cell(cell) if cell_class[0] == "text" else None for (_, _, cell), cell_class in zip(cells, classes)]
+    cells_info = analyze_cells(cells, store_template_dir, backend=backend, top_k=top_k, classes=classes, targets=targets)
+
+    # 文字のあるセルだけを、常駐の OCR エンジンでまとめて読む
+    if OCR_ENABLED if ocr is None else ocr:
+        ocr_cells(cells, cells_info, targets)
+
+    return {
+        "md5": file_hash,
+        "rotation": rotation,
+        "table_coords": table_coords,
+        "layout": layout.name,
+        "header": header,
+        "cells": cells,
+        "cells_info": cells_info
+    }
+
+def pipeline_fingerprint(store_template_dir=STORE_TEMPLATE_DIR):
+    """ 解析結果に影響する設定とテンプレート群のフィンガープリント（結果キャッシュのキー用） """
+    config = {
+        "layout": LAYOUT,
+        "layouts": get_layout_registry().fingerprint(),
+        "grid_mode": GRID_MODE,
+        "match_top_k": MATCH_TOP_K,
+        "coarse_scale": COARSE_SCALE,
+        "match_index": [MATCH_INDEX, INDEX_SCALE] if MATCH_INDEX == "orb" else MATCH_INDEX,
+        "match_method": MATCH_METHOD,
+        "match_accept": [MATCH_ACCEPT, MATCH_MARGIN] if MATCH_ACCEPT > 0 else None,
+        "match_keep": MATCH_KEEP,
+        "auto_orient": AUTO_ORIENT,
+        "ocr": [OCR_LANG, OCR_PSM] if OCR_ENABLED else None,
+        "line_removal": LINE_MIN_RATIO if LINE_REMOVAL else None,
+        "templates": get_template_bank(store_template_dir).fingerprint()
+    }
+    return hashlib.md5(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()
+
+def write_result(result, output_dir):
+    """ 出力ステージ：ヘッダー・セル画像と cells.json を output_dir に書き出す """
+    return write_cells(output_dir, result["header"], result["cells"], result["cells_info"], result["md5"], result["layout"])
+
+def process_upload(file_data, output_root=OUTPUT_ROOT, write_outputs=True):
+    """
+    アップロードされたバイト列を処理する
+
+    :param file_data: 画像のバイト列
+    :param output_root: 出力先のルートディレクトリ
+    :param write_outputs: False の場合はディスクへ一切書き出さない
+    :return: (result, cell_paths)
+    """
+    file_hash = hashlib.md5(file_data).hexdigest()
+    result = run_pipeline(decode_image(file_data), file_hash)
+
+    cell_paths = []
+    if write_outputs:
+        cell_paths = write_result(result, os.path.join(output_root, file_hash))
+
+    return result, cell_paths
+
+def store_upload(file_data, file_hash=None, output_root=OUTPUT_ROOT, cache=None, index=None):
+    """
+    元画像を保存して解析し、セル画像と cells.json を書き出す（/python/split_table の本体）
+
+    :param file_data: 画像のバイト列。None の場合は output_root/<file_hash>.jpeg に保存済み
+    :param file_hash: file_data の md5（省略時は計算する）
+    :param output_root: 出力先のルートディレクトリ
+    :param cache: result_cache.ResultCache（省略時はキャッシュを使わない）
+    :param index: upload_index.UploadIndex（保存した元画像を登録する。省略時は登録しない）
+    :return: {"directory", "md5", "rotation", "layout", "cells"} の dict（失敗時は例外）
+    """
+    if file_hash is None:
+        file_hash = hashlib.md5(file_data).hexdigest()
+    filepath = os.path.join(output_root, f"{file_hash}.jpeg")
+    output_dir = os.path.join(output_root, file_hash)
+
+    # 結果キャッシュ：同じ画像・同じ設定／テンプレートで解析済みならそのまま返す
+    cache_key = None
+    if cache is not None:
+        cache_key = make_key(file_hash, pipeline_fingerprint())
+        cached = cache.get(cache_key)
+        if cached is not None and os.path.exists(os.path.join(output_dir, "cells.json")):
+            inc(RESULT_CACHE, result="hit")
+            return cached
+        inc(RESULT_CACHE, result="miss")
+
+    # 元画像はそのまま保存（一覧表示用）。解析はメモリ上のデータから行う
+    if file_data is None:
+        file_data = np.fromfile(filepath, np.uint8)
+    else:
+        with open(filepath, "wb") as f:
+            f.write(file_data)
+        inc(BYTES_WRITTEN, len(file_data), kind="original")
+        if index is not None:
+            index.add(os.path.basename(filepath))
+
+    # デコード → 表の外枠検出 → セル分割 → 店舗照合（すべてメモリ上）
+    result = run_pipeline(decode_image(file_data), file_hash)
+
+    # 出力ステージ：セル画像と cells.json を書き出す
+    cell_paths = write_result(result, output_dir)
+
+    # 保存されたファイルのパスを返す
+    response = {
+        "directory": f"/opencv/{file_hash}/",
+        "md5": f"{file_hash}",
+        "rotation": result["rotation"],
+        "layout": result["layout"],
+        "cells": [f"/opencv/{file_hash}/{os.path.basename(cell)}" for cell in cell_paths]
+    }
+    if cache is not None:
+        cache.put(cache_key, response)
+    return response
+
+# デバッグ用
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python pipeline.py <image_path>")
+        sys.exit(1)
+
+    with open(sys.argv[1], "rb") as f:
+        result, _ = process_upload(f.read(), write_outputs=False)
+
+    print("layout:", result["layout"])
+    for info in result["cells_info"]:
+        print(info["row"], info["column"], info["type"], info["store_match"][:1])
@@ -0,0 +1,87 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+# 解析結果（split_table_api のレスポンス）のキャッシュ。
+# キーは画像の md5 ＋ パイプライン設定とテンプレート群のフィンガープリントなので、
+# テンプレートや設定が変わると以前のエントリはヒットしなくなる。
+# ファイルとして保存するため、複数の Web ワーカー間で共有される。
+CACHE_DIR = "/var/www/html/opencv/.result_cache"
+CACHE_MAX_ENTRIES = int(os.environ.get("TIMETABLE_CACHE_MAX_ENTRIES", "1000"))
+CACHE_MAX_AGE = int(os.environ.get("TIMETABLE_CACHE_MAX_AGE", str(7 * 24 * 3600)))  # 秒
+
+def make_key(file_hash, fingerprint):
+    """ 画像の md5 とパイプラインのフィンガープリントからキャッシュキーを作成 """
+    return hashlib.md5(f"{file_hash}:{fingerprint}".encode("utf-8")).hexdigest()
+
+class ResultCache:
+    """ 件数・経過時間で追い出すファイルベースの結果キャッシュ """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_entries=CACHE_MAX_ENTRIES, max_age=CACHE_MAX_AGE):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        """ キャッシュされた値を返す。無い・古い場合は None """
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                os.remove(path)
+                return None
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, value):
+        """ 値を保存し、上限を超えた古いエントリを追い出す """
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """ 期限切れのエントリと、max_entries を超えた古いエントリを削除 """
+        with self._lock:
+            entries = []
+            now = time.time()
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if not entry.name.endswith(".json"):
+                        continue
+                    try:
+                        mtime = entry.stat().st_mtime
+                    except OSError:
+                        continue
+                    if now - mtime > self.max_age:
+                        self._remove(entry.path)
+                    else:
+                        entries.append((mtime, entry.path))
+
+            entries.sort()
+            for _, path in entries[:max(0, len(entries) - self.max_entries)]:
+                self._remove(path)
+
+    def clear(self):
+        """ すべてのエントリを削除 """
+        with self._lock:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".json"):
+                    self._remove(os.path.join(self.cache_dir, name))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,276 @@
+import os
+import sys
+import mmap
+import struct
+import tempfile
+from collections import Counter
+
+import numpy as np
+
+# cells.json と同じ内容を持つ、コンパクトなバイナリ形式 (cells.bin)。
+# 店舗ごとのスコアを「セル数 x 店舗数」の行列に詰め、店舗名などの文字列は文字列表にまとめる。
+# 読み込み側はファイルをメモリマップし、必要な配列だけを取り出す（JSON 全体のパースが不要）。
+#
+# レイアウト（リトルエンディアン、各セクションは 8 バイト境界にそろえる）
+#   ヘッダー   HEADER 参照
+#   cells      CELL_DTYPE x セル数
+#   scores     float32 [セル数, 店舗数]（照合していない店舗は NaN）
+#   top_y      int32   [セル数, 店舗数]（照合していない店舗は -1）
+#   offsets    uint32  [文字列数 + 1]
+#   strings    UTF-8 の文字列を連結したもの（先頭から店舗名、最後に様式の名前）
+#   （FLAG_TEXT の場合のみ。OCR の結果で、これより前の配置は変わらない）
+#   ocr        OCR_DTYPE x セル数（OCR していないセルは length = -1）
+#   ocr_text   UTF-8 の文字列を連結したもの（ocr の start・length で取り出す）
+RESULT_BINARY_NAME = "cells.bin"
+WRITE_BINARY = os.environ.get("TIMETABLE_WRITE_BINARY", "1") == "1"
+
+MAGIC = b"TTRB"
+VERSION = 1
+# magic, version, flags, セル数, 店舗数, 文字列表のバイト数, 行数, 列数, md5 (16 バイト)
+HEADER = struct.Struct("<4sHHIIIHH16s")
+CELL_DTYPE = np.dtype([("row", "<u2"), ("column", "<u2"), ("type", "u1"), ("_pad", "u1", 3), ("black_ratio", "<f4")])
+CELL_TYPES = ("empty", "text")
+FLAG_LAYOUT = 1  # 文字列表の最後が様式の名前
+FLAG_TEXT = 2  # 末尾に OCR の結果（cells_info の "text"・"text_confidence"）がある
+OCR_DTYPE = np.dtype([("start", "<u4"), ("length", "<i4"), ("confidence", "<i4"), ("_pad", "u1", 4)])
+
+def _align(n):
+    return (n + 7) & ~7
+
+def encode_result(cells_info, file_hash, layout=None):
+    """
+    cells_info（cells.json の "cells"）をバイナリ形式に変換する
+
+    :raises ValueError: CELL_TYPES に無い type のセルがある場合
+    """
+    unknown = {info["type"] for info in cells_info} - set(CELL_TYPES)
+    if unknown:
+        raise ValueError(f"Unknown cell types: {sorted(unknown)}")
+
+    stores = sorted({match[0] for info in cells_info for match in info["store_match"]})
+    store_index = {name: i for i, name in enumerate(stores)}
+
+    cells = np.zeros(len(cells_info), dtype=CELL_DTYPE)
+    scores = np.full((len(cells_info), len(stores)), np.nan, dtype="<f4")
+    top_y = np.full((len(cells_info), len(stores)), -1, dtype="<i4")
+    for i, info in enumerate(cells_info):
+        cells[i] = (info["row"], info["column"], CELL_TYPES.index(info["type"]), 0, info["black_ratio"])
+        for store_name, score, y in info["store_match"]:
+            scores[i, store_index[store_name]] = score
+            top_y[i, store_index[store_name]] = y
+
+    strings = [name.encode("utf-8") for name in stores]
+    flags = 0
+    if layout is not None:
+        strings.append(layout.encode("utf-8"))
+        flags |= FLAG_LAYOUT
+    offsets = np.zeros(len(strings) + 1, dtype="<u4")
+    offsets[1:] = np.cumsum([len(s) for s in strings])
+    blob = b"".join(strings)
+
+    sections = [cells.tobytes(), scores.tobytes(), top_y.tobytes(), offsets.tobytes(), blob]
+    if any("text" in info for info in cells_info):
+        flags |= FLAG_TEXT
+        ocr = np.zeros(len(cells_info), dtype=OCR_DTYPE)
+        ocr["length"] = -1
+        texts = []
+        start = 0
+        for i, info in enumerate(cells_info):
+            if "text" not in info:
+                continue
+            text = info["text"].encode("utf-8")
+            ocr[i] = (start, len(text), info.get("text_confidence", -1), 0)
+            texts.append(text)
+            start += len(text)
+        sections += [ocr.tobytes(), b"".join(texts)]
+
+    rows = int(cells["row"].max()) + 1 if len(cells) else 0
+    columns = int(cells["column"].max()) + 1 if len(cells) else 0
+    header = HEADER.pack(MAGIC, VERSION, flags, len(cells), len(stores), len(blob), rows, columns, bytes.fromhex(file_hash))
+
+    parts = []
+    for part in [header] + sections:
+        parts.append(part + b"\0" * (_align(len(part)) - len(part)))
+    return b"".join(parts)
+
+def write_result_file(path, cells_info, file_hash, layout=None):
+    """ バイナリ形式の結果を書き出す（一時ファイルに書いてから置き換える） """
+    data = encode_result(cells_info, file_hash, layout)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return path
+
+class ResultFile:
+    """
+    cells.bin をメモリマップして読む。各配列はファイル上のデータをそのまま参照する（コピーしない）
+
+    :raises ValueError: 形式が違う・対応していないバージョン・途中で切れている（空を含む）場合
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._buffer = None
+        self.cells = self.scores = self.top_y = self._offsets = self.ocr = None
+        with open(path, "rb") as f:
+            # 空のファイルは mmap できないので先に調べる
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                raise ValueError(f"Truncated result file: {path}")
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._parse()
+        except Exception:
+            self.close()
+            raise
+
+    def _parse(self):
+        path = self.path
+        magic, version, flags, n_cells, n_stores, blob_size, self.rows, self.columns, md5 = HEADER.unpack_from(self._buffer)
+        if magic != MAGIC:
+            raise ValueError(f"Not a result file: {path}")
+        if version != VERSION:
+            raise ValueError(f"Unsupported result file version {version}: {path}")
+        self.version = version
+        self.md5 = md5.hex()
+        self._flags = flags
+        self._n_stores = n_stores
+
+        n_strings = n_stores + (1 if flags & FLAG_LAYOUT else 0)
+        size = (_align(HEADER.size) + _align(n_cells * CELL_DTYPE.itemsize) + 2 * _align(n_cells * n_stores * 4)
+                + _align((n_strings + 1) * 4) + blob_size)
+        if len(self._buffer) < size:
+            raise ValueError(f"Truncated result file: {path}")
+
+        offset = _align(HEADER.size)
+        self.cells = np.frombuffer(self._buffer, CELL_DTYPE, n_cells, offset)
+        offset += _align(self.cells.nbytes)
+        self.scores = np.frombuffer(self._buffer, "<f4", n_cells * n_stores, offset).reshape(n_cells, n_stores)
+        offset += _align(self.scores.nbytes)
+        self.top_y = np.frombuffer(self._buffer, "<i4", n_cells * n_stores, offset).reshape(n_cells, n_stores)
+        offset += _align(self.top_y.nbytes)
+        self._offsets = np.frombuffer(self._buffer, "<u4", n_strings + 1, offset)
+        self._strings_offset = offset + _align(self._offsets.nbytes)
+        self._strings = None
+
+        if flags & FLAG_TEXT:
+            offset = self._strings_offset + _align(blob_size)
+            if len(self._buffer) < offset + n_cells * OCR_DTYPE.itemsize:
+                raise ValueError(f"Truncated result file: {path}")
+            self.ocr = np.frombuffer(self._buffer, OCR_DTYPE, n_cells, offset)
+            self._text_offset = offset + _align(self.ocr.nbytes)
+            texts = self.ocr[self.ocr["length"] >= 0]
+            text_size = int((texts["start"] + texts["length"]).max()) if len(texts) else 0
+            if len(self._buffer) < self._text_offset + text_size:
+                raise ValueError(f"Truncated result file: {path}")
+
+    def _string_table(self):
+        if self._strings is None:
+            blob = self._buffer[self._strings_offset:self._strings_offset + int(self._offsets[-1])]
+            self._strings = [blob[a:b].decode("utf-8") for a, b in zip(self._offsets[:-1], self._offsets[1:])]
+        return self._strings
+
+    @property
+    def stores(self):
+        """ scores / top_y の列に対応する店舗名 """
+        return self._string_table()[:self._n_stores]
+
+    @property
+    def layout(self):
+        return self._string_table()[-1] if self._flags & FLAG_LAYOUT else None
+
+    def best_matches(self):
+        """ セルごとの最もスコアの高い店舗 [(row, column, store_name, score), ...]（照合なしは除く） """
+        if self.scores.shape[1] == 0:
+            return []
+        matched = ~np.isnan(self.scores).all(axis=1)
+        best = np.nanargmax(np.where(matched[:, None], self.scores, 0), axis=1)
+        stores = self.stores
+        return [
+            (int(cell["row"]), int(cell["column"]), stores[j], float(self.scores[i, j]))
+            for i, (cell, j) in enumerate(zip(self.cells, best)) if matched[i]
+        ]
+
+    def cells_info(self):
+        """ cells.json と同じ形式の cells_info を組み立てる """
+        stores = self.stores
+        cells_info = []
+        for i, cell in enumerate(self.cells):
+            row, column = int(cell["row"]), int(cell["column"])
+            matched = np.flatnonzero(~np.isnan(self.scores[i]))
+            order = matched[np.argsort(-self.scores[i, matched], kind="stable")]
+            cells_info.append({
+                "row": row,
+                "column": column,
+                "filename": f"{row}_{column}.jpeg",
+                "type": CELL_TYPES[cell["type"]],
+                "black_ratio": float(cell["black_ratio"]),
+                "store_match": [[stores[j], float(self.scores[i, j]), int(self.top_y[i, j])] for j in order]
+            })
+            if self.ocr is not None and self.ocr[i]["length"] >= 0:
+                start = self._text_offset + int(self.ocr[i]["start"])
+                cells_info[-1]["text"] = self._buffer[start:start + int(self.ocr[i]["length"])].decode("utf-8")
+                cells_info[-1]["text_confidence"] = int(self.ocr[i]["confidence"])
+        return cells_info
+
+    def close(self):
+        # ndarray がバッファを参照している間は mmap を閉じられないため、先に参照を外す
+        self.cells = self.scores = self.top_y = self._offsets = self.ocr = None
+        if self._buffer is None:
+            return
+        try:
+            self._buffer.close()
+        except BufferError:
+            pass  # 呼び出し側が配列を保持している場合は GC に任せる
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_result(directory):
+    """
+    出力ディレクトリの cells.bin を開く（無ければ None）
+
+    :raises ValueError: cells.bin が壊れている場合（ResultFile）
+    """
+    path = os.path.join(directory, RESULT_BINARY_NAME)
+    if not os.path.exists(path):
+        return None
+    return ResultFile(path)
+
+def iter_results(output_root):
+    """ output_root 直下の各出力ディレクトリの ResultFile を順に返す（読めないものはスキップ） """
+    with os.scandir(output_root) as it:
+        for entry in it:
+            path = os.path.join(entry.path, RESULT_BINARY_NAME)
+            if not entry.is_dir() or not os.path.exists(path):
+                continue
+            try:
+                result = ResultFile(path)
+            except (OSError, ValueError):
+                continue
+            with result:
+                yield result
+
+def count_best_stores(output_root, min_score=0.0):
+    """ 全シートについて、セルごとの最上位の店舗を集計する Counter を返す """
+    counts = Counter()
+    for result in iter_results(output_root):
+        counts.update(store for _, _, store, score in result.best_matches() if score >= min_score)
+    return counts
+
+# 集計用：python result_format.py <output_root> [min_score]
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python result_format.py <output_root> [min_score]")
+        sys.exit(1)
+
+    min_score = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    for store, count in count_best_stores(sys.argv[1], min_score).most_common():
+        print(f"{store}\t{count}")
@@ -3,92 +3,435 @@ import numpy as np
 import os
 import json
 import sys
-from store_recognition import compare_to_directory, process_matching_results
+from store_recognition import (
+    MATCH_TOP_K, STORE_TEMPLATE_DIR, candidate_templates, fits, get_template_bank,
+    match_templates, process_matching_results, template_matching
+)
+from layouts import LAYOUT, get_layout, get_layout_registry
+from result_format import RESULT_BINARY_NAME, WRITE_BINARY, write_result_file
+from workers import map_ordered
+from cell_preprocess import preprocess_cell
+from metrics import BYTES_WRITTEN, TEMPLATE_MATCHES, inc, timed
 
-def classify_cell(image, output_dir, r, c):
+OUTPUT_ROOT = "/var/www/html/opencv"
+
+# classify_cell のパラメータ（セル外周の罫線を避ける余白と、白とみなす閾値）
+CELL_MARGIN_H = 0.08
+CELL_MARGIN_W = 0.17
+WHITE_THRESHOLD = 200
+EMPTY_RATIO = 0.95
+
+# 様式の自動選択で罫線を調べるときの、射影変換後の表の幅
+LAYOUT_PROBE_WIDTH = 400
+
+# セルの区切り方："lines" は実際の罫線の位置に合わせる、"ratios" は様式の割合のまま
+GRID_MODE = os.environ.get("TIMETABLE_GRID_MODE", "lines")
+GRID_PROBE_SCALE = 0.5  # 罫線を探すときの縮小率
+GRID_SNAP_TOLERANCE = 0.03  # 様式の区切りから罫線を探す範囲（表の幅・高さに対する割合）
+GRID_LINE_COVERAGE = 0.5  # 罫線とみなす長さ（探す範囲の長さに対する割合）
+
+def _classify(image):
+    """ セルの内側（余白を除いた部分）の白い画素の割合で空欄を判定し (type, black_ratio) を返す """
     height, width = image.shape[:2]
-    margin_h = int(height * 0.08)
-    margin_w = int(width * 0.17)
+    margin_h = int(height * CELL_MARGIN_H)
+    margin_w = int(width * CELL_MARGIN_W)
     cropped = image[margin_h:height-margin_h, margin_w:width-margin_w]
     gray = cv2.cvtColor(cropped, cv2.COLOR_BGR2GRAY)
-    _, binary = cv2.threshold(gray, 200, 255, cv2.THRESH_BINARY_INV)
-    black_pixels = np.count_nonzero(binary == 0)
-    black_ratio = black_pixels / binary.size
-    return "text" if black_ratio <= 0.95 else "empty", black_ratio
-
-def split_table(image_path, table_coords,file_hash):
-    rows = 7
-    col_ratios_list = [
-        [0.2, 0.4, 0.6, 0.8],
-        [0.2, 0.4, 0.6, 0.79],
-        [0.2, 0.4, 0.6, 0.78],
-        [0.2, 0.4, 0.59, 0.78],
-        [0.2, 0.4, 0.59, 0.78],
-        [0.2, 0.39, 0.59, 0.78],
-        [0.2, 0.39, 0.58, 0.77]
-    ]
-    image = cv2.imread(image_path)
-    if image is None:
-        raise ValueError("画像を読み込めません")
-    
-    base_name = os.path.splitext(os.path.basename(image_path))[0]
-    output_dir = os.path.join("/var/www/html/opencv", base_name)
-    os.makedirs(output_dir, exist_ok=True)
-    
+    # 閾値より明るい画素を数える（真偽値の一時配列を作らない）
+    _, white = cv2.threshold(gray, WHITE_THRESHOLD, 255, cv2.THRESH_BINARY)
+    black_ratio = cv2.countNonZero(white) / white.size
+    return "text" if black_ratio <= EMPTY_RATIO else "empty", black_ratio
+
+@timed("classify_cell")
+def classify_cell(image, output_dir, r, c):
+    return _classify(image)
+
+@timed("classify_cells")
+def classify_cells(cells):
+    """
+    cut_cells で切り出した表のセルをまとめて分類する（classify_cell と同じ結果）
+
+    :param cells: [(row, column, cell_image), ...]
+    :return: [(type, black_ratio), ...]（cells と同じ順序）
+    """
+    return [_classify(cell) for _, _, cell in cells]
+
+def warp_table(image, table_coords):
+    """
+    カラー画像から表を射影変換し、ヘッダー（表より上の部分）と合わせて返す
+
+    :return: (table_warped, header, (width, height)) width/height は変換先の実数サイズ
+    """
+    M, (width, height) = table_transform(table_coords)
+    table_warped = cv2.warpPerspective(image, M, (int(width), int(height)))
+
+    return table_warped, table_header(image, table_coords), (width, height)
+
+def table_transform(table_coords):
+    """
+    四隅の座標から、表を長方形に射影変換する行列と変換先のサイズを求める
+
+    :return: (M, (width, height)) width/height は実数
+    """
     src_pts = np.array(table_coords, dtype=np.float32).reshape(4, 2)
     width = max(np.linalg.norm(src_pts[0] - src_pts[1]), np.linalg.norm(src_pts[2] - src_pts[3]))
     height = max(np.linalg.norm(src_pts[0] - src_pts[3]), np.linalg.norm(src_pts[1] - src_pts[2]))
-    
+
     dst_pts = np.array([[0, 0], [width, 0], [width, height], [0, height]], dtype=np.float32)
-    M = cv2.getPerspectiveTransform(src_pts, dst_pts)
-    table_warped = cv2.warpPerspective(image, M, (int(width), int(height)))
+    return cv2.getPerspectiveTransform(src_pts, dst_pts), (width, height)
+
+def table_header(image, table_coords):
+    """ ヘッダー（表の左上の点より上の部分）を返す """
+    return image[:int(table_coords[1]), :]
+
+def cell_rects(width, height, layout=None):
+    """ 射影変換後の表でのセル矩形 [(row, column, x1, y1, x2, y2), ...] を返す（省略時は既定の様式） """
+    return (layout or get_layout()).cell_rects(width, height)
+
+def layout_score(binary, layout):
+    """
+    様式の罫線の位置に実際に線があるかを 0〜1 で返す
+
+    :param binary: 射影変換後の表を二値化した画像（線が 1）
+    """
+    h, w = binary.shape
+    tol = max(2, w // 100)
+    coverage = []
+    for edge in layout.row_edges[1:-1]:
+        y = int(round(edge * h))
+        coverage.append(binary[max(0, y - tol):y + tol + 1].mean(axis=1).max())
+    for r in range(layout.rows):
+        y0, y1 = int(layout.row_edges[r] * h), int(layout.row_edges[r + 1] * h)
+        for edge in layout.col_edges[r][1:-1]:
+            x = int(round(edge * w))
+            coverage.append(binary[y0:y1, max(0, x - tol):x + tol + 1].mean(axis=0).max())
+    return float(np.mean(coverage)) if coverage else 0.0
+
+@timed("select_layout")
+def select_layout(table_coords, gray=None, name=None):
+    """
+    表に合う様式を返す
+
+    name（省略時は layouts.LAYOUT）が "auto" の場合、表の縦横比が許容範囲内の様式から選ぶ。
+    候補が複数あり gray が渡された場合は、罫線の位置が最も合う様式
+    （ほぼ同点なら区切りの多い様式）を選ぶ。
+
+    :param gray: 向き補正済みのグレースケール画像
+    """
+    name = name or LAYOUT
+    registry = get_layout_registry()
+    if name != "auto":
+        return registry.get(name)
+
+    layouts = list(registry.layouts().values())
+    if len(layouts) == 1:
+        return layouts[0]
+    if not layouts:
+        raise ValueError("No layouts defined")
+
+    M, (width, height) = table_transform(table_coords)
+    aspect = height / width
+
+    def aspect_error(layout):
+        if not layout.aspect_ratio:
+            return layout.aspect_tolerance  # 縦横比の指定が無い様式は常に候補
+        return abs(aspect / layout.aspect_ratio - 1)
+
+    candidates = [layout for layout in layouts if aspect_error(layout) <= layout.aspect_tolerance]
+    if not candidates:
+        return min(layouts, key=aspect_error)
+    if len(candidates) == 1 or gray is None:
+        return min(candidates, key=aspect_error)
+
+    # 縮小して射影変換した表で罫線を調べる
+    binary = table_probe(gray, table_coords, LAYOUT_PROBE_WIDTH / width)
+
+    scores = {layout.name: layout_score(binary, layout) for layout in candidates}
+    best = max(scores.values())
+    close = [layout for layout in candidates if scores[layout.name] >= best - 0.05]
+    return max(close, key=lambda layout: (layout.cell_count, scores[layout.name]))
+
+def table_probe(gray, table_coords, scale):
+    """ グレースケール画像の表を scale 倍の大きさで射影変換し、二値化（線が 1）して返す """
+    M, (width, height) = table_transform(table_coords)
+    S = np.array([[scale, 0, 0], [0, scale, 0], [0, 0, 1]])
+    size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    probe = cv2.warpPerspective(gray, S @ M, size)
+    _, binary = cv2.threshold(cv2.GaussianBlur(probe, (3, 3), 0), 150, 1, cv2.THRESH_BINARY_INV)
+    return binary
+
+def line_centers(profile, threshold):
+    """ 1 次元の射影プロファイルで threshold 以上の区間ごとに、その中心（重み付き）を返す """
+    on = np.concatenate(([False], profile >= threshold, [False]))
+    changes = np.flatnonzero(on[1:] != on[:-1])
+    centers = []
+    for start, end in zip(changes[::2], changes[1::2]):
+        weights = profile[start:end]
+        centers.append(float(np.dot(np.arange(start, end), weights) / weights.sum()))
+    return np.array(centers)
+
+def snap(position, lines, tolerance):
+    """ position に最も近い罫線の位置を返す（tolerance 以内に無ければ position のまま） """
+    if len(lines):
+        nearest = lines[np.argmin(np.abs(lines - position))]
+        if abs(nearest - position) <= tolerance:
+            return nearest
+    return position
+
+@timed("extract_grid")
+def extract_grid(gray, table_coords, layout=None, scale=GRID_PROBE_SCALE):
+    """
+    射影変換後の表で実際の罫線を探し、様式の区切りをその位置に合わせたセル矩形を返す
+
+    横罫線・縦罫線をそれぞれモルフォロジー演算（細長いカーネルのオープニング）で取り出し、
+    射影プロファイルのピークを罫線の位置とする。縦罫線は行ごとに探す（行によって列の位置がずれるため）。
+    様式の区切りから GRID_SNAP_TOLERANCE 以内に罫線が無い区切りは割合のままにする。
+
+    :param gray: 向き補正済みのグレースケール画像
+    :return: [(row, column, x1, y1, x2, y2), ...]（cell_rects と同じ形式・座標系）
+    """
+    layout = layout or get_layout()
+    _, (width, height) = table_transform(table_coords)
+    rects = layout.cell_rects(width, height)
+
+    binary = table_probe(gray, table_coords, scale)
+    h, w = binary.shape
+
+    # 横罫線：幅の 1/4 以上続く水平線
+    horizontal = cv2.morphologyEx(binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (max(1, w // 4), 1)))
+    row_lines = line_centers(horizontal.sum(axis=1) / w, GRID_LINE_COVERAGE) / scale
+
+    row_edges = sorted({y for _, _, _, y1, _, y2 in rects for y in (y1, y2)})
+    snapped_rows = {y: y for y in row_edges}
+    for y in row_edges[1:-1]:  # 外枠は検出済みの四隅のまま
+        snapped_rows[y] = int(round(snap(y, row_lines, height * GRID_SNAP_TOLERANCE)))
+
+    snapped = []
+    for r in range(layout.rows):
+        row_rects = [rect for rect in rects if rect[0] == r]
+        y1, y2 = snapped_rows[row_rects[0][3]], snapped_rows[row_rects[0][5]]
+
+        # 縦罫線：行の高さの半分以上続く垂直線（上下の横罫線は避ける）
+        inset = (y2 - y1) // 8
+        band = binary[int((y1 + inset) * scale):int((y2 - inset) * scale)]
+        col_lines = np.array([])
+        if band.shape[0] > 1:
+            vertical = cv2.morphologyEx(band, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(1, band.shape[0] // 2))))
+            col_lines = line_centers(vertical.sum(axis=0) / band.shape[0], GRID_LINE_COVERAGE) / scale
+
+        xs = [row_rects[0][2]] + [rect[4] for rect in row_rects]
+        xs = xs[:1] + [int(round(snap(x, col_lines, width * GRID_SNAP_TOLERANCE))) for x in xs[1:-1]] + xs[-1:]
+        snapped += [(r, c, xs[c], y1, xs[c + 1], y2) for c in range(len(xs) - 1)]
+
+    return snapped
+
+def crop_cells(table_warped, rects):
+    """ セル矩形を切り出し、正方形にリサイズして [(row, column, cell_image), ...] で返す """
+    cells = []
+    for r, c, x1, y1, x2, y2 in rects:
+        cell = table_warped[y1:y2, x1:x2]
+        size = max(x2 - x1, y2 - y1)
+        cells.append((r, c, cv2.resize(cell, (size, size))))
+    return cells
+
+class CellGrid:
+    """
+    四隅の座標から、各セルの画素が元画像のどこに当たるかを表す射影変換行列を持つ
+
+    射影変換 → 切り出し → リサイズ（warp_table + crop_cells）は、セルごとに見れば
+    1 つの射影変換にまとめられる。表全体を変換せずに、各セルを最終サイズで直接サンプリングする。
+    行列はセルごとに 3x3 だけなので、作成は速くメモリもほとんど使わない。
+
+    セルは様式の割合で区切った矩形を正方形に引き伸ばす（crop_cells と同じ）。rects（extract_grid の結果）を
+    渡した場合はその矩形を切り出すが、拡大率は様式の矩形と同じにする（テンプレートと文字の大きさをそろえるため）。
+    """
+
+    def __init__(self, table_coords, layout=None, rects=None):
+        M, (width, height) = table_transform(table_coords)
+        inv = np.linalg.inv(M)
+        self.layout = layout or get_layout()
+        nominal = self.layout.cell_rects(width, height)
+        self.rects = rects or nominal
+        self.transforms = []
+
+        for (r, c, x1, y1, x2, y2), (_, _, nx1, ny1, nx2, ny2) in zip(self.rects, nominal):
+            w, h = x2 - x1, y2 - y1
+            size = max(nx2 - nx1, ny2 - ny1)
+            out_w = max(1, int(round(w * size / (nx2 - nx1))))
+            out_h = max(1, int(round(h * size / (ny2 - ny1))))
+            # リサイズ後の画素 (u, v) → 射影変換後の座標（cv2.resize と同じ画素中心の対応）
+            sx, sy = w / out_w, h / out_h
+            scale = np.array([[sx, 0, x1 + 0.5 * sx - 0.5], [0, sy, y1 + 0.5 * sy - 0.5], [0, 0, 1]])
+            # 射影変換後の座標 → 元画像の座標
+            self.transforms.append((r, c, inv @ scale, (out_w, out_h)))
+
+        self.nbytes = sum(H.nbytes for _, _, H, _ in self.transforms)
+
+    def sample(self, image):
+        """ 各セルを切り出して [(row, column, cell_image), ...] で返す """
+        flags = cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP  # 行列はセルの画素 → 元画像の向き
+        return [(r, c, cv2.warpPerspective(image, H, size, flags=flags)) for r, c, H, size in self.transforms]
+
+@timed("cut_cells")
+def cut_cells(image, table_coords, layout=None, rects=None):
+    """
+    カラー画像からヘッダーと各セル画像を切り出す
+
+    :param image: カラー画像 (ndarray)
+    :param table_coords: detect_table の戻り値 [x1, y1, ..., x4, y4]
+    :param layout: layouts.Layout（省略時は既定の様式）
+    :param rects: extract_grid で求めたセル矩形（省略時は様式の割合で区切る）
+    :return: (header, [(row, column, cell_image), ...])
+    """
+    cells = CellGrid(table_coords, layout, rects).sample(image)
+    return table_header(image, table_coords), cells
+
+def _cell_info(r, c, cell_type, black_ratio, store_matches):
+    return {
+        "row": r,
+        "column": c,
+        "filename": f"{r}_{c}.jpeg",
+        "type": cell_type,
+        "black_ratio": black_ratio,
+        "store_match": store_matches
+    }
+
+def _cell_target(cell):
+    """ 照合用にセル画像を二値化（罫線は取り除く。OCR と同じ前処理） """
+    return preprocess_cell(cell)
+
+def analyze_cell(r, c, cell, bank, top_k=None, cell_class=None, target=None):
+    """
+    セル画像を分類し、文字があれば店舗テンプレートと照合して cells_info の1要素を返す
+
+    :param cell_class: classify_cell で求めた (type, black_ratio)。省略時はここで分類
+    :param target: preprocess_cell 済みの二値画像（省略時はここで求める）
+    """
+    if cell_class is None:
+        cell_class = classify_cell(cell, None, r, c)
+    cell_type, black_ratio = cell_class
+
+    store_matches = []
+    if cell_type == "text":
+        if target is None:
+            target = _cell_target(cell)
+        store_matches = process_matching_results(match_templates(target, bank, top_k))
+
+    return _cell_info(r, c, cell_type, black_ratio, store_matches)
+
+def _analyze_cell_task(r, c, cell, store_template_dir, top_k, cell_class, target):
+    # ワーカー側（プロセスプールの場合は各プロセス）の TemplateBank を使う
+    return analyze_cell(r, c, cell, get_template_bank(store_template_dir), top_k, cell_class, target)
+
+@timed("analyze_cells")
+def analyze_cells(cells, store_template_dir=STORE_TEMPLATE_DIR, backend=None, granularity="cell", max_workers=None, top_k=None, classes=None, targets=None):
+    """
+    切り出したセル画像をすべて解析し、行・列順の cells_info を返す
+
+    :param backend: 実行方式 "serial" / "thread" / "process"（workers.EXECUTOR_BACKEND）
+    :param granularity: "cell" はセル単位、"pair" はセル×テンプレート単位で並列化
+    :param max_workers: ワーカー数（省略時は workers.MAX_WORKERS）
+    :param top_k: 原寸照合する候補のテンプレート数（省略時は MATCH_TOP_K、0 以下で全探索）
+    :param classes: セルごとの classify_cell の戻り値（省略時はここで分類）
+    :param targets: セルごとの preprocess_cell 済みの二値画像（None の要素・省略時はここで求める）
+    """
+    if top_k is None:
+        top_k = MATCH_TOP_K
+    if classes is None:
+        classes = [None] * len(cells)
+    if targets is None:
+        targets = [None] * len(cells)
+    if granularity == "cell":
+        n = len(cells)
+        return map_ordered(
+            _analyze_cell_task,
+            [r for r, _, _ in cells], [c for _, c, _ in cells], [cell for _, _, cell in cells],
+            [store_template_dir] * n, [top_k] * n, classes, targets,
+            backend=backend, max_workers=max_workers
+        )
+    if granularity != "pair":
+        raise ValueError(f"Unknown granularity: {granularity}")
+
+    # 分類は軽いので逐次で行い、照合だけをセル×テンプレートに展開する
+    bank = get_template_bank(store_template_dir)
+    classified = [
+        (r, c, cell) + (cell_class or classify_cell(cell, None, r, c))
+        for (r, c, cell), cell_class in zip(cells, classes)
+    ]
+    text_cells = [i for i, (_, _, _, cell_type, _) in enumerate(classified) if cell_type == "text"]
+    targets = {i: targets[i] if targets[i] is not None else _cell_target(classified[i][2]) for i in text_cells}
+
+    # セルごとに原寸照合する候補を絞り込んでから展開する
+    candidates = {i: candidate_templates(targets[i], bank, top_k) for i in text_cells}
+
+    pairs = [
+        (i, filename, template)
+        for i in text_cells for filename, template in candidates[i]
+        if fits(targets[i], template)
+    ]
+    inc(TEMPLATE_MATCHES, len(pairs), kind="full")
+    matched = map_ordered(
+        template_matching,
+        [targets[i] for i, _, _ in pairs], [template for _, _, template in pairs],
+        backend=backend, max_workers=max_workers
+    )
+
+    scores = {i: [] for i in text_cells}
+    for (i, filename, _), (score_tm, top_left, bottom_right) in zip(pairs, matched):
+        scores[i].append((filename, score_tm, top_left, bottom_right))
+
+    cells_info = []
+    for i, (r, c, _, cell_type, black_ratio) in enumerate(classified):
+        store_matches = []
+        if i in scores:
+            # compare_image と同じくスコアが高い順に並べてから集約
+            scores[i].sort(key=lambda x: x[1], reverse=True)
+            store_matches = process_matching_results(scores[i])
+        cells_info.append(_cell_info(r, c, cell_type, black_ratio, store_matches))
+    return cells_info
+
+@timed("write_cells")
+def write_cells(output_dir, header, cells, cells_info, file_hash, layout=None):
+    """
+    出力ステージ：ヘッダー・セル画像（JPEG）と cells.json（WRITE_BINARY なら cells.bin も）を書き出す
+
+    :param layout: 使った様式の名前（cells.json に記録する）
+
+    :return: 書き出したセル画像のパスのリスト
+    """
+    os.makedirs(output_dir, exist_ok=True)
 
-    header_height = int(src_pts[0][1])
-    header = image[:header_height, :]
     header_path = os.path.join(output_dir, "header.jpeg")
     cv2.imwrite(header_path, header)
-    
-    store_template_dir = "/var/www/html/opencv/store_template/"
 
-    row_height = int(height / rows)
     cell_paths = []
-    cells_info = []
-    
-    for r in range(rows):
-        col_ratios = col_ratios_list[r]
-        col_positions = [0] + [int(width * ratio) for ratio in col_ratios] + [int(width)]
-        
-        for c in range(len(col_positions) - 1):
-            x1, x2 = col_positions[c], col_positions[c + 1]
-            y1, y2 = r * row_height, (r + 1) * row_height
-            cell = table_warped[y1:y2, x1:x2]
-            cell_resized = cv2.resize(cell, (max(x2 - x1, row_height), max(x2 - x1, row_height)))
-            
-            cell_filename = f"{r}_{c}.jpeg"
-            cell_filepath = os.path.join(output_dir, cell_filename)
-            cv2.imwrite(cell_filepath, cell_resized)
-            cell_paths.append(cell_filepath)
-            
-            cell_type, black_ratio = classify_cell(cell_resized, output_dir, r, c)
-
-            store_matches = []
-            if cell_type == "text":
-                store_matches = compare_to_directory(cell_filepath, store_template_dir)
-                store_matches = process_matching_results(store_matches)
-
-            cells_info.append({
-                "row": r,
-                "column": c,
-                "filename": cell_filename,
-                "type": cell_type,
-                "black_ratio": black_ratio,
-                "store_match": store_matches
-            })
-    
+    for (r, c, cell), info in zip(cells, cells_info):
+        cell_filepath = os.path.join(output_dir, info["filename"])
+        cv2.imwrite(cell_filepath, cell)
+        cell_paths.append(cell_filepath)
+
+    data = {"cells":cells_info,"md5":file_hash}
+    if layout is not None:
+        data["layout"] = layout
+
     json_path = os.path.join(output_dir, "cells.json")
     with open(json_path, "w") as json_file:
-        json.dump(
-            {"cells":cells_info,"md5":file_hash}
-        , json_file, indent=4)
-    
+        json.dump(data, json_file, indent=4)
+
+    inc(BYTES_WRITTEN, sum(os.path.getsize(path) for path in [header_path] + cell_paths), kind="images")
+    inc(BYTES_WRITTEN, os.path.getsize(json_path), kind="json")
+
+    binary_path = os.path.join(output_dir, RESULT_BINARY_NAME)
+    if WRITE_BINARY:
+        try:
+            write_result_file(binary_path, cells_info, file_hash, layout)
+            inc(BYTES_WRITTEN, os.path.getsize(binary_path), kind="binary")
+        except ValueError:
+            # バイナリ形式で表せない結果（未知の type など）は cells.json だけにする（古い cells.bin は削除）
+            if os.path.exists(binary_path):
+                os.remove(binary_path)
+    elif os.path.exists(binary_path):
+        # view_table は cells.bin を優先して読むので、以前の実行で書いたものを残さない
+        os.remove(binary_path)
+
     return cell_paths
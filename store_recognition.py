@@ -1,39 +1,323 @@
 import cv2
+import hashlib
 import numpy as np
 import os
 import sys
+import threading
+import time
 
 from collections import defaultdict
 
-def process_matching_results(results):
+from metrics import INDEX_LOOKUPS, TEMPLATE_MATCHES, inc, timed
+from cell_preprocess import preprocess_cell
+from fft_match import TemplateSpectra
+
+# 既知の店舗名画像が入っているディレクトリ
+STORE_TEMPLATE_DIR = "/var/www/html/opencv/store_template/"
+TEMPLATE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+# テンプレートのディレクトリを調べ直す間隔（秒）。templates() はセルごとに何度も呼ばれるため、
+# この間隔の間は前回の結果を使う（0 なら毎回調べる）
+TEMPLATE_CHECK_INTERVAL = float(os.environ.get("TIMETABLE_TEMPLATE_CHECK_INTERVAL", "5"))
+
+# 粗密探索：候補を MATCH_TOP_K 件に絞ってから原寸で照合する（1 以上を指定した場合のみ）
+# 既定の 0 は従来どおり全テンプレートを原寸で照合する。絞り込むと候補から漏れたセルの
+# store_match（2 位以下や店舗名）が全探索と変わることがある（--recall で確かめてから有効にする）
+MATCH_TOP_K = int(os.environ.get("TIMETABLE_MATCH_TOP_K", "0"))
+COARSE_SCALE = 0.5
+MIN_COARSE_SIZE = 8  # 縮小後にこれより小さくなるテンプレートは粗探索で判定しない
+
+# 候補の絞り込み方式（MATCH_TOP_K が 1 以上の場合）。
+# "coarse" は縮小画像で全テンプレートを matchTemplate する（テンプレート数に比例して遅くなる）。
+# "orb" はテンプレートの ORB 特徴量の索引で投票して MATCH_TOP_K * INDEX_OVERSAMPLE 件に絞り、
+# その中から縮小画像の matchTemplate で MATCH_TOP_K 件を選ぶ。速いが、パイプラインで切り出した
+# セルでの再現率は coarse より低い（benchmark.py の shortlist_recall_by_index）ので既定にしない
+MATCH_INDEX = os.environ.get("TIMETABLE_MATCH_INDEX", "coarse")
+INDEX_OVERSAMPLE = 2
+INDEX_SCALE = 0.5            # 特徴量は縮小画像から求める
+INDEX_TEMPLATE_FEATURES = 50  # テンプレート 1 枚あたりの特徴点の上限
+INDEX_TARGET_FEATURES = 100   # セル画像の特徴点の上限
+INDEX_MAX_DISTANCE = 64       # これより遠い（ハミング距離）対応は投票しない
+INDEX_RATIO = 0.8             # 最近傍と 2 番目の距離の比がこれ未満の対応だけ投票する
+# 特徴量の総数がこれ以上なら全件比較をやめ、LSH（近似最近傍）で探す
+INDEX_LSH_MIN = int(os.environ.get("TIMETABLE_INDEX_LSH_MIN", "5000"))
+
+# 原寸での照合方式。"fft" はテンプレートの DFT を保持しておき、セル画像の DFT を 1 回だけ求めて
+# 全テンプレートに使い回す（fft_match）。"spatial" はテンプレートごとに cv2.matchTemplate を呼ぶ
+MATCH_METHOD = os.environ.get("TIMETABLE_MATCH_METHOD", "fft")
+
+# 打ち切り：ある店舗のスコアが MATCH_ACCEPT 以上で、ほかの店舗（照合済みのもの）より
+# MATCH_MARGIN 以上高くなったら残りのテンプレートは照合しない。テンプレートは過去に
+# 最良一致になった回数の多い順に照合する。MATCH_ACCEPT が 0 以下なら打ち切らない。
+# 1 つのセルに店舗名が 2 つある場合、打ち切ると 2 つ目の店舗が結果に残らないことがある
+MATCH_ACCEPT = float(os.environ.get("TIMETABLE_MATCH_ACCEPT", "0"))
+MATCH_MARGIN = float(os.environ.get("TIMETABLE_MATCH_MARGIN", "0.3"))
+# cells.json に残す店舗の数（スコアの高い順）。0 以下ならすべて残す
+MATCH_KEEP = int(os.environ.get("TIMETABLE_MATCH_KEEP", "0"))
+
+def store_name_of(filename):
+    """ テンプレートのファイル名から店舗名を取り出す（最後の "_" 以降） """
+    return os.path.splitext(filename)[0].split("_")[-1]
+
+def process_matching_results(results, keep=None):
     """
     テンプレートマッチング結果を加工し、各店舗ごとに最大スコアのエントリを取得。
     
     :param results: [(filename, score, top_left, bottom_right), ...] のリスト
-    :return: [(store_name, score, top_y_coordinate)]
+    :param keep: 残す店舗の数（スコアの高い順。省略時は MATCH_KEEP、0 以下ならすべて）
+    :return: [(store_name, score, top_y_coordinate)]（スコア降順）
     """
+    if keep is None:
+        keep = MATCH_KEEP
     if not results:
         return []
 
     store_best_matches = defaultdict(lambda: (None, float('-inf'), None))
 
     for filename, score, top_left, bottom_right in results:
-        store_name = os.path.splitext(filename)[0].split("_")[-1]  # 最後の要素が店舗名
+        store_name = store_name_of(filename)  # 最後の要素が店舗名
         top_y_coordinate = top_left[1]  # Y座標 (top_left[1])
 
         # その店舗のスコア最大のエントリを保持
         if score > store_best_matches[store_name][1]:  # 現在の最大スコアより高ければ更新
             store_best_matches[store_name] = (store_name, score, top_y_coordinate)
 
-    # 各店舗の最大スコアエントリをリストに変換
-    return list(store_best_matches.values())
+    # 各店舗の最大スコアエントリをスコア降順のリストに変換
+    matches = sorted(store_best_matches.values(), key=lambda x: x[1], reverse=True)
+    return matches[:keep] if keep > 0 else matches
+
 
+def binarize(gray):
+    """ グレースケール画像をバイナリ化 """
+    _, thresh = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY_INV)
+    return thresh
 
 def preprocess_image(image_path):
-    """ 画像をグレースケール変換し、バイナリ化 """
+    """ セル画像を読み込み、パイプラインと同じ前処理（二値化・罫線の除去）を行う """
     image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-    _, thresh = cv2.threshold(image, 127, 255, cv2.THRESH_BINARY_INV)
-    return thresh
+    return preprocess_cell(image)
+
+def downscale(image, scale):
+    """ 粗探索用に画像を縮小 """
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+class TemplateBank:
+    """
+    テンプレート画像を一度だけ読み込み・二値化して保持する。
+    ディレクトリの mtime やファイル構成が変わった場合は自動で読み込み直す
+    （調べるのは check_interval 秒に 1 回）。
+    """
+
+    def __init__(self, directory_path, check_interval=TEMPLATE_CHECK_INTERVAL):
+        self.directory_path = directory_path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._signature = None
+        self._checked = None  # 最後にディレクトリを調べた時刻（time.monotonic）
+        self._templates = []  # [(filename, binary), ...]
+        self._coarse = {}  # scale -> (templates, [(filename, 縮小画像), ...])
+        self._index = (None, None)  # (templates, TemplateIndex)
+        self._spectra = (None, None)  # (templates, TemplateSpectra)
+        self._hits = {}  # filename -> 最良一致になった回数（打ち切りの照合順に使う）
+
+    def _scan(self):
+        """ ディレクトリの状態（mtime・ファイル名・サイズ）を取得 """
+        entries = []
+        with os.scandir(self.directory_path) as it:
+            for entry in it:
+                if not entry.name.lower().endswith(TEMPLATE_EXTENSIONS):
+                    continue  # 画像以外はスキップ
+                st = entry.stat()
+                entries.append((entry.name, st.st_mtime_ns, st.st_size))
+        entries.sort()
+        return (os.stat(self.directory_path).st_mtime_ns, tuple(entries))
+
+    def _load(self, signature):
+        templates = []
+        for filename, _, _ in signature[1]:
+            template_path = os.path.join(self.directory_path, filename)
+            image = cv2.imread(template_path, cv2.IMREAD_GRAYSCALE)
+            if image is None:
+                continue  # 読み込めない画像はスキップ
+            templates.append((filename, binarize(image)))
+        return templates
+
+    @property
+    def signature(self):
+        """ 現在読み込まれているテンプレート群の状態 """
+        return self._signature
+
+    def fingerprint(self):
+        """ テンプレート群の状態を表すハッシュ値（内容が変われば変わる） """
+        self.templates()
+        return hashlib.md5(repr(self._signature[1]).encode("utf-8")).hexdigest()
+
+    def templates(self):
+        """ 二値化済みテンプレートのリスト [(filename, binary), ...] を返す """
+        now = time.monotonic()
+        checked = self._checked
+        if checked is not None and now - checked < self.check_interval:
+            return self._templates
+        signature = self._scan()
+        if signature != self._signature:
+            with self._lock:
+                if signature != self._signature:
+                    self._templates = self._load(signature)
+                    self._signature = signature
+        self._checked = now
+        return self._templates
+
+    def record_hit(self, filename):
+        """ filename のテンプレートが最良一致になったことを記録する """
+        with self._lock:
+            self._hits[filename] = self._hits.get(filename, 0) + 1
+
+    def by_hits(self, templates):
+        """ templates を最良一致になった回数の多い順に並べ替える（同じ回数なら元の順序） """
+        hits = self._hits
+        return sorted(templates, key=lambda t: -hits.get(t[0], 0))
+
+    def coarse_templates(self, scale=COARSE_SCALE):
+        """
+        縮小済みテンプレートを返す（読み込み直しがあれば作り直す）
+
+        :return: (templates, [(filename, 縮小画像), ...]) 両者は同じ順序
+        """
+        templates = self.templates()
+        with self._lock:
+            cached = self._coarse.get(scale)
+            if cached is None or cached[0] is not templates:
+                cached = (templates, [(filename, downscale(t, scale)) for filename, t in templates])
+                self._coarse[scale] = cached
+        return cached
+
+    def template_index(self):
+        """ テンプレートの特徴量の索引 TemplateIndex を返す（読み込み直しがあれば作り直す） """
+        templates = self.templates()
+        with self._lock:
+            if self._index[0] is not templates:
+                self._index = (templates, TemplateIndex(templates))
+            return self._index[1]
+
+    def template_spectra(self):
+        """ 周波数領域での照合に使う TemplateSpectra を返す（読み込み直しがあれば作り直す） """
+        templates = self.templates()
+        with self._lock:
+            if self._spectra[0] is not templates:
+                self._spectra = (templates, TemplateSpectra(templates))
+            return self._spectra[1]
+
+
+def _orb(nfeatures):
+    # 店舗名の画像は小さいので、縁の除外幅・パッチを既定 (31) より小さくする
+    return cv2.ORB_create(nfeatures=nfeatures, edgeThreshold=8, patchSize=15, fastThreshold=10)
+
+def _index_image(binary, scale=INDEX_SCALE):
+    """ 特徴量を求める画像（縮小して二値画像の段差をぼかす） """
+    return cv2.GaussianBlur(downscale(binary, scale), (3, 3), 0)
+
+class TemplateIndex:
+    """
+    テンプレートの ORB 特徴量（32 バイトのバイナリ記述子）を 1 つの行列にまとめた索引。
+
+    セル画像の特徴量ごとに最近傍の記述子を探し、その記述子を持つテンプレートに投票する。
+    得票の多いテンプレートだけを matchTemplate で確認すればよいので、
+    テンプレートが増えても 1 セルあたりの matchTemplate の回数は増えない。
+    同じ店舗のテンプレートはよく似ていて得票では順位が決まりにくいため、
+    最終的な順位は matchTemplate で決める。
+    """
+
+    def __init__(self, templates, scale=INDEX_SCALE, lsh_min=INDEX_LSH_MIN):
+        self.templates = templates
+        self.scale = scale
+        self._local = threading.local()  # ORB はスレッドごとに作る
+        self._lock = threading.Lock()
+
+        orb = _orb(INDEX_TEMPLATE_FEATURES)
+        descriptors = []
+        labels = []
+        self.unindexed = []  # 特徴点が取れない（小さすぎる）テンプレートの番号。常に候補に含める
+        for i, (_, template) in enumerate(templates):
+            _, d = orb.detectAndCompute(_index_image(template, scale), None)
+            if d is None:
+                self.unindexed.append(i)
+                continue
+            descriptors.append(d)
+            labels.append(np.full(len(d), i, dtype=np.int32))
+
+        self.descriptors = np.vstack(descriptors) if descriptors else np.empty((0, 32), np.uint8)
+        self.labels = np.concatenate(labels) if labels else np.empty(0, np.int32)
+        # 特徴点の多いテンプレートが有利にならないよう、得票を sqrt(特徴点数) で割る
+        self._weights = 1.0 / np.sqrt(np.maximum(np.bincount(self.labels, minlength=len(templates)), 1))
+
+        self._flann = None
+        if len(self.descriptors) >= lsh_min:
+            self._flann = cv2.FlannBasedMatcher(
+                dict(algorithm=6, table_number=4, key_size=24, multi_probe_level=1),  # FLANN_INDEX_LSH
+                dict(checks=32)
+            )
+            self._flann.add([self.descriptors])
+            self._flann.train()
+        else:
+            self._bf = cv2.BFMatcher(cv2.NORM_HAMMING)
+
+    def _knn(self, descriptors):
+        if self._flann is None:
+            return self._bf.knnMatch(descriptors, self.descriptors, k=2)
+        # 学習済みの FLANN の索引を複数のスレッドから同時に引かない
+        with self._lock:
+            return self._flann.knnMatch(descriptors, k=2)
+
+    def votes(self, target_image):
+        """
+        テンプレートごとの得票（templates と同じ順序）
+
+        :return: ndarray。セル画像から特徴点が取れない場合は None
+        """
+        orb = getattr(self._local, "orb", None)
+        if orb is None:
+            orb = self._local.orb = _orb(INDEX_TARGET_FEATURES)
+        _, descriptors = orb.detectAndCompute(_index_image(target_image, self.scale), None)
+        if descriptors is None or len(self.descriptors) < 2:
+            return None
+
+        matches = [(m[0].trainIdx, m[0].distance, m[1].distance) for m in self._knn(descriptors) if len(m) == 2]
+        if not matches:
+            return None
+        matches = np.array(matches)
+        ok = (matches[:, 1] < INDEX_MAX_DISTANCE) & (matches[:, 1] < INDEX_RATIO * matches[:, 2])
+        votes = np.bincount(self.labels[matches[ok, 0].astype(np.intp)], minlength=len(self.templates))
+        return votes * self._weights
+
+    def candidates(self, target_image, n):
+        """
+        得票の多い n 件（と索引に無いテンプレート）の templates での番号
+
+        :return: [i, ...]。得票が無い場合は None
+        """
+        votes = self.votes(target_image)
+        if votes is None or not votes.any():
+            return None
+        top = np.argsort(-votes, kind="stable")[:n]
+        return self.unindexed + [i for i in top.tolist() if votes[i] > 0]
+
+
+_template_banks = {}
+_template_banks_lock = threading.Lock()
+
+def get_template_bank(directory_path=STORE_TEMPLATE_DIR):
+    """ ディレクトリごとに共有される TemplateBank を取得 """
+    key = os.path.abspath(directory_path)
+    with _template_banks_lock:
+        bank = _template_banks.get(key)
+        if bank is None:
+            bank = TemplateBank(directory_path)
+            _template_banks[key] = bank
+    return bank
+
+def fits(target, template):
+    """ テンプレートがターゲットに収まる（照合できる）か """
+    return template.shape[0] <= target.shape[0] and template.shape[1] <= target.shape[1]
 
 def template_matching(target, template):
     """ テンプレートマッチングを使用してスコア計算と座標取得 """
@@ -47,44 +331,222 @@ def template_matching(target, template):
 
     return max_val, top_left, bottom_right
 
+def _score_templates(target_image, templates, spectra):
+    """ templates の順に照合し (templates での番号, (filename, score, top_left, bottom_right)) を 1 件ずつ返す """
+    match = None
+    for i, (filename, template_image) in enumerate(templates):
+        if not fits(target_image, template_image):
+            continue  # テンプレートの方が大きい場合は照合できない
+        position = spectra.position(filename, template_image) if spectra is not None else None
+        if position is None:
+            yield i, (filename,) + template_matching(target_image, template_image)
+            continue
+        if match is None:
+            match = spectra.matcher(target_image)  # セル画像の DFT は最初の 1 回だけ求める
+        score_tm, top_left = match(position)
+        h, w = template_image.shape[:2]
+        yield i, (filename, score_tm, top_left, (top_left[0] + w, top_left[1] + h))
+
+def compare_image(target_image, templates, spectra=None, accept=0, margin=MATCH_MARGIN):
+    """
+    二値化済みのターゲット画像をテンプレート群と比較し、スコアと座標を返す
+
+    :param target_image: 二値化済みの画像 (ndarray)
+    :param templates: [(filename, binary), ...]（TemplateBank.templates() の戻り値）
+    :param spectra: TemplateSpectra。指定した場合はその DFT を使って周波数領域で照合する
+                    （spectra に無いテンプレートは matchTemplate で照合）
+    :param accept: 0 より大きければ、ある店舗のスコアが accept 以上で、照合済みのほかの店舗
+                   （1 店舗以上）より margin 以上高くなった時点で残りのテンプレートを照合しない
+                   （templates の順に照合する）
+    :return: [(filename, score, top_left, bottom_right), ...]（スコア降順。打ち切った場合は照合した分だけ）
+    """
+    scores = []
+    store_best = {}  # 店舗名 -> 照合済みの最大スコア
+    for i, entry in _score_templates(target_image, templates, spectra):
+        scores.append(entry)
+        if accept <= 0:
+            continue
+        store_name = store_name_of(entry[0])
+        store_best[store_name] = max(entry[1], store_best.get(store_name, float("-inf")))
+        if _decisive(store_best, accept, margin):
+            # 収まらないテンプレートはもともと照合しないので数えない
+            skipped = sum(1 for _, template_image in templates[i + 1:] if fits(target_image, template_image))
+            inc(TEMPLATE_MATCHES, skipped, kind="skipped")
+            break
+
+    inc(TEMPLATE_MATCHES, len(scores), kind="full")
+
+    # スコアが高い順にソート
+    scores.sort(key=lambda x: x[1], reverse=True)
+
+    return scores
+
+def _decisive(store_best, accept, margin):
+    """
+    最もスコアの高い店舗が accept 以上で、2 番目の店舗より margin 以上高いか
+    （ほかの店舗をまだ 1 つも照合していなければ比べられないので False）
+    """
+    if len(store_best) < 2:
+        return False
+    first, second = float("-inf"), float("-inf")
+    for score in store_best.values():
+        if score > first:
+            first, second = score, first
+        elif score > second:
+            second = score
+    return first >= accept and first - second >= margin
+
+def shortlist_templates(target_image, templates, coarse_templates, top_k, scale=COARSE_SCALE):
+    """
+    縮小画像で全テンプレートを評価し、原寸で照合すべき候補を返す
+
+    縮小すると小さすぎる・ターゲットより大きくなるテンプレートは
+    粗探索で判定できないため、常に候補に含める。
+    """
+    small_target = downscale(target_image, scale)
+    th, tw = small_target.shape[:2]
+
+    forced = []
+    ranked = []
+    for (filename, template), (_, small) in zip(templates, coarse_templates):
+        h, w = small.shape[:2]
+        if min(h, w) < MIN_COARSE_SIZE or h > th or w > tw:
+            forced.append((filename, template))
+            continue
+        res = cv2.matchTemplate(small_target, small, cv2.TM_CCOEFF_NORMED)
+        ranked.append((cv2.minMaxLoc(res)[1], filename, template))
+
+    inc(TEMPLATE_MATCHES, len(ranked), kind="coarse")
+
+    ranked.sort(key=lambda x: x[0], reverse=True)
+    return forced + [(filename, template) for _, filename, template in ranked[:top_k]]
+
+@timed("shortlist")
+def candidate_templates(target_image, bank, top_k=None, scale=COARSE_SCALE, index=None):
+    """
+    原寸で照合するテンプレートを絞り込む
+
+    :param top_k: 候補の数（0 以下・テンプレート数以上なら全テンプレート）
+    :param index: 絞り込み方式 "orb" / "coarse"（省略時は MATCH_INDEX）。
+                  "orb" で得票が無い場合（特徴点の取れないセル）は全テンプレートから "coarse" で絞り込む
+    :return: [(filename, binary), ...]
+    """
+    if top_k is None:
+        top_k = MATCH_TOP_K
+    if index is None:
+        index = MATCH_INDEX
+    if index not in ("orb", "coarse"):
+        raise ValueError(f"Unknown match index: {index}")
+    templates, coarse = bank.coarse_templates(scale)
+    if top_k <= 0 or top_k >= len(templates):
+        return templates
+
+    selected = None
+    if index == "orb":
+        template_index = bank.template_index()
+        selected = template_index.candidates(target_image, top_k * INDEX_OVERSAMPLE)
+        inc(INDEX_LOOKUPS, result="fallback" if selected is None else "hit")
+
+    if selected is not None and template_index.templates is templates:
+        # 索引の候補の中から縮小画像で top_k 件を選ぶ
+        templates = [templates[i] for i in selected]
+        coarse = [coarse[i] for i in selected]
+    return shortlist_templates(target_image, templates, coarse, top_k, scale)
+
+def bank_spectra(bank, method=None):
+    """ 照合方式が "fft" なら bank の TemplateSpectra、"spatial" なら None """
+    if method is None:
+        method = MATCH_METHOD
+    if method not in ("fft", "spatial"):
+        raise ValueError(f"Unknown match method: {method}")
+    return bank.template_spectra() if method == "fft" else None
+
+@timed("match_templates")
+def match_templates(target_image, bank, top_k=None, scale=COARSE_SCALE, index=None, method=None, accept=None):
+    """
+    二値化済みのターゲット画像を TemplateBank のテンプレートと照合する
+
+    top_k が 1 以上なら候補を top_k 件に絞ってから原寸で照合し（candidate_templates）、
+    0 以下なら全テンプレートを原寸で照合する。
+
+    :param method: 原寸での照合方式 "fft" / "spatial"（省略時は MATCH_METHOD）
+    :param accept: 打ち切りのスコア（省略時は MATCH_ACCEPT、0 以下なら打ち切らない）
+    :return: [(filename, score, top_left, bottom_right), ...]（スコア降順）
+    """
+    if accept is None:
+        accept = MATCH_ACCEPT
+    candidates = candidate_templates(target_image, bank, top_k, scale, index)
+    if accept <= 0:
+        return compare_image(target_image, candidates, bank_spectra(bank, method))
+
+    # よく最良一致になるテンプレートから照合し、決まった時点で打ち切る
+    scores = compare_image(target_image, bank.by_hits(candidates), bank_spectra(bank, method), accept)
+    if scores and scores[0][1] >= accept:
+        bank.record_hit(scores[0][0])
+    return scores
+
+def pruning_recall(target_images, bank, top_k=None, scale=COARSE_SCALE, min_score=0.5, index=None):
+    """
+    粗密探索の再現率：全探索での最良テンプレートが、絞り込み後も最良として残った割合
+
+    :param target_images: 二値化済みのターゲット画像のリスト
+    :param min_score: 全探索の最良スコアがこれ未満の画像（該当店舗なし）は対象外
+    :return: (recall, 対象画像数)
+    """
+    hits = 0
+    total = 0
+    for target_image in target_images:
+        exhaustive = compare_image(target_image, bank.templates(), bank_spectra(bank))
+        if not exhaustive or exhaustive[0][1] < min_score:
+            continue
+        total += 1
+        pruned = match_templates(target_image, bank, top_k, scale, index)
+        if pruned and pruned[0][0] == exhaustive[0][0]:
+            hits += 1
+    return (hits / total if total else 1.0), total
+
+@timed("compare_to_directory")
 def compare_to_directory(target_image_path, directory_path, visualize=False):
     """ ターゲット画像をディレクトリ内の画像と比較し、スコアと座標を出力 """
     target_image = preprocess_image(target_image_path)
-    scores = []
-    
-    for filename in os.listdir(directory_path):
-        template_path = os.path.join(directory_path, filename)
-        if not filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-            continue  # 画像以外はスキップ
 
-        template_image = preprocess_image(template_path)
-        score_tm, top_left, bottom_right = template_matching(target_image, template_image)
+    # テンプレートは共有の TemplateBank から取得（読み込み・二値化済み）
+    scores = match_templates(target_image, get_template_bank(directory_path))
 
-        scores.append((filename, score_tm, top_left, bottom_right))
-
-        # 検出位置を描画（オプション）
-        if visualize and score_tm > 0.5:  # しきい値以上のみ表示
+    # 検出位置を描画（オプション）
+    if visualize:
+        for filename, score_tm, top_left, bottom_right in scores:
+            if score_tm <= 0.5:  # しきい値以上のみ表示
+                continue
             target_color = cv2.imread(target_image_path)
             cv2.rectangle(target_color, top_left, bottom_right, (0, 255, 0), 2)
             cv2.imshow(f"Match: {filename}", target_color)
             cv2.waitKey(0)
             cv2.destroyAllWindows()
 
-    # スコアが高い順にソート
-    scores.sort(key=lambda x: x[1], reverse=True)
-
     return scores
 
 if __name__ == "__main__":
+    if len(sys.argv) in (3, 4) and sys.argv[1] == "--recall":
+        # 粗密探索の再現率を確認（セル画像のディレクトリに対して全探索と比較）
+        cell_dir = sys.argv[2]
+        top_k = int(sys.argv[3]) if len(sys.argv) == 4 else MATCH_TOP_K
+        targets = [
+            preprocess_image(os.path.join(cell_dir, f))
+            for f in sorted(os.listdir(cell_dir)) if f.lower().endswith(TEMPLATE_EXTENSIONS)
+        ]
+        recall, total = pruning_recall(targets, get_template_bank(STORE_TEMPLATE_DIR), top_k)
+        print(f"top_k={top_k} images={len(targets)} matched={total} recall={recall:.3f}")
+        sys.exit(0)
+
     if len(sys.argv) != 2:
         print("Usage: python store_recognition.py <image_path>")
+        print("       python store_recognition.py --recall <cell_dir> [top_k]")
         sys.exit(1)
 
     target_image_path = sys.argv[1]
 
-    directory_path = "/var/www/html/opencv/store_template/"  # 既知の店舗名画像が入っているディレクトリ
-
-    results = compare_to_directory(target_image_path, directory_path)
+    results = compare_to_directory(target_image_path, STORE_TEMPLATE_DIR)
 
     processed_results = process_matching_results(results)
     print(processed_results)
@@ -0,0 +1,35 @@
+import json
+
+import numpy as np
+import cv2
+import pytest
+
+import split_table
+from layouts import LayoutRegistry, get_layout_registry
+from split_table import select_layout
+
+WIDTH, HEIGHT, MARGIN = 500, 680, 40  # 縦横比 1.36（同梱の 7x5 の様式と同じ）
+
+def _table(layout):
+    """ 様式の罫線を引いた白地の画像と、表の四隅の座標を返す """
+    image = np.full((HEIGHT + 2 * MARGIN, WIDTH + 2 * MARGIN), 255, dtype=np.uint8)
+    for r, c, x1, y1, x2, y2 in layout.cell_rects(WIDTH, HEIGHT):
+        cv2.rectangle(image, (MARGIN + x1, MARGIN + y1), (MARGIN + x2, MARGIN + y2), 0, 3)
+    coords = [MARGIN, MARGIN, MARGIN + WIDTH, MARGIN, MARGIN + WIDTH, MARGIN + HEIGHT, MARGIN, MARGIN + HEIGHT]
+    return image, coords
+
+@pytest.mark.parametrize("name", ["timetable_7x5", "timetable_7x5_uniform"])
+def test_select_layout_by_rule_lines(name):
+    # 縦横比の同じ様式が 2 つあるので、罫線の位置で選ぶ
+    layouts = get_layout_registry().layouts()
+    assert {"timetable_7x5", "timetable_7x5_uniform"} <= set(layouts)
+    image, coords = _table(layouts[name])
+    assert select_layout(coords, image, "auto").name == name
+
+def test_select_layout_by_aspect_ratio(tmp_path, monkeypatch):
+    for name, rows, aspect in [("tall", 7, 1.36), ("wide", 3, 0.5)]:
+        with open(tmp_path / f"{name}.json", "w") as f:
+            json.dump({"rows": rows, "columns": 5, "aspect_ratio": aspect}, f)
+    monkeypatch.setattr(split_table, "get_layout_registry", lambda: LayoutRegistry(str(tmp_path)))
+    assert select_layout([0, 0, 100, 0, 100, 140, 0, 140], None, "auto").name == "tall"
+    assert select_layout([0, 0, 100, 0, 100, 48, 0, 48], None, "auto").name == "wide"
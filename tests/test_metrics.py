@@ -0,0 +1,42 @@
+import os
+import time
+import glob
+
+import cv2
+
+from metrics import collect_timings, timed
+from workers import map_ordered
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _sleep(x):
+    with timed("test_sleep"):
+        time.sleep(0.01)
+    return x
+
+def test_collect_timings_includes_thread_pool_work():
+    with collect_timings() as timings:
+        assert map_ordered(_sleep, range(8), backend="thread", max_workers=4) == list(range(8))
+    # 8 回分（並列に動いた分も合計）
+    assert timings["test_sleep"] >= 0.075
+
+def test_collect_timings_does_not_leak_outside_block():
+    with collect_timings() as timings:
+        pass
+    map_ordered(_sleep, range(2), backend="thread", max_workers=2)
+    assert timings == {}
+
+def test_analyze_cells_stages_with_thread_backend():
+    from split_table import analyze_cells
+
+    cells = []
+    for path in sorted(glob.glob(os.path.join(BASE_DIR, "cells", "001", "*.jpeg")))[:6]:
+        r, c = map(int, os.path.splitext(os.path.basename(path))[0].split("_"))
+        cells.append((r, c, cv2.imread(path)))
+    assert cells
+
+    with collect_timings() as timings:
+        analyze_cells(cells, os.path.join(BASE_DIR, "store_templates"), backend="thread", max_workers=4, top_k=3)
+    assert "analyze_cells" in timings
+    assert "match_templates" in timings
+    assert "shortlist" in timings
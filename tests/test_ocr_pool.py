@@ -0,0 +1,73 @@
+import sys
+import types
+
+import numpy as np
+import pytest
+
+import ocr_pool
+import ocr_preprocess
+
+class StubEngine:
+    """ tesserocr.PyTessBaseAPI の代わり（画像の幅を文字列として返す） """
+
+    def __init__(self, path=None, lang=None, psm=None):
+        self.width = None
+
+    def SetPageSegMode(self, psm):
+        pass
+
+    def SetImageBytes(self, data, w, h, bpp, bpl):
+        self.width = w
+
+    def GetUTF8Text(self):
+        return f"w{self.width}\n"
+
+    def MeanTextConf(self):
+        return 90
+
+    def Clear(self):
+        pass
+
+    def End(self):
+        pass
+
+def _broken_engine(path=None, lang=None, psm=None):
+    raise RuntimeError("Failed to init API, possibly an invalid tessdata path")
+
+@pytest.fixture
+def tesserocr(monkeypatch):
+    """ スタブの tesserocr を import させ、共有の OcrPool を作り直す """
+    module = types.ModuleType("tesserocr")
+    module.PyTessBaseAPI = StubEngine
+    monkeypatch.setitem(sys.modules, "tesserocr", module)
+    monkeypatch.setattr(ocr_pool, "_pool", None)
+    monkeypatch.setattr(ocr_pool, "_pool_error", None)
+    return module
+
+def _cells():
+    cells = [(0, c, np.full((40, 40 + 10 * c, 3), 255, dtype=np.uint8)) for c in range(3)]
+    cells_info = [{"type": "text"}, {"type": "empty"}, {"type": "text"}]
+    return cells, cells_info
+
+def test_ocr_cells_with_stub_engine(tesserocr):
+    cells, cells_info = _cells()
+    ocr_pool.ocr_cells(cells, cells_info)
+    assert cells_info[0]["text"].startswith("w") and cells_info[0]["text_confidence"] == 90
+    assert "text" not in cells_info[1]
+    assert "text" in cells_info[2]
+
+def test_ocr_cells_skips_when_engine_fails_to_initialize(tesserocr):
+    tesserocr.PyTessBaseAPI = _broken_engine
+    cells, cells_info = _cells()
+    assert ocr_pool.ocr_cells(cells, cells_info) is cells_info
+    assert all("text" not in info for info in cells_info)
+    # 失敗は覚えておき、アップロードのたびに作り直さない
+    with pytest.raises(RuntimeError):
+        ocr_pool.get_ocr_pool()
+
+def test_perform_ocr_falls_back_to_pytesseract(tesserocr, monkeypatch):
+    tesserocr.PyTessBaseAPI = _broken_engine
+    pytesseract = types.ModuleType("pytesseract")
+    pytesseract.image_to_string = lambda image, lang=None, config=None: f"pytesseract {lang} {config}"
+    monkeypatch.setitem(sys.modules, "pytesseract", pytesseract)
+    assert ocr_preprocess.perform_ocr(np.zeros((20, 20), dtype=np.uint8)) == "pytesseract jpn --psm 6"
@@ -0,0 +1,41 @@
+import pytest
+
+from result_format import ResultFile, write_result_file
+
+def _cells_info():
+    cells_info = []
+    for row in range(2):
+        for column in range(3):
+            cells_info.append({
+                "row": row, "column": column, "filename": f"{row}_{column}.jpeg",
+                "type": "text" if column else "empty", "black_ratio": 0.25,
+                "store_match": [["ageo", 0.75, 10], ["hasuda", 0.5, -1]] if column else []
+            })
+    cells_info[1].update(text="上尾\n", text_confidence=91)
+    cells_info[2].update(text="", text_confidence=-1)
+    return cells_info
+
+def test_round_trip_keeps_ocr_fields(tmp_path):
+    path = str(tmp_path / "cells.bin")
+    cells_info = _cells_info()
+    write_result_file(path, cells_info, "0" * 32, "default")
+    with ResultFile(path) as result:
+        assert (result.rows, result.columns, result.layout) == (2, 3, "default")
+        # black_ratio・スコアは float32 で保存する（ここでは誤差なく表せる値を使う）
+        assert result.cells_info() == cells_info
+
+def test_round_trip_without_ocr(tmp_path):
+    path = str(tmp_path / "cells.bin")
+    cells_info = [info for info in _cells_info() if "text" not in info]
+    write_result_file(path, cells_info, "0" * 32)
+    with ResultFile(path) as result:
+        assert result.ocr is None
+        assert result.cells_info() == cells_info
+
+def test_truncated_ocr_section_is_rejected(tmp_path):
+    path = str(tmp_path / "cells.bin")
+    write_result_file(path, _cells_info(), "0" * 32, "default")
+    with open(path, "r+b") as f:
+        f.truncate(f.seek(0, 2) - 4)
+    with pytest.raises(ValueError):
+        ResultFile(path)
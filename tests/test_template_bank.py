@@ -0,0 +1,32 @@
+import os
+import time
+
+import numpy as np
+import cv2
+
+from store_recognition import TemplateBank
+
+def _write(directory, name):
+    image = np.full((20, 40), 255, dtype=np.uint8)
+    cv2.putText(image, name[:2], (2, 15), cv2.FONT_HERSHEY_SIMPLEX, 0.4, 0, 1)
+    cv2.imwrite(os.path.join(directory, name), image)
+
+def test_templates_are_rescanned_after_check_interval(tmp_path, monkeypatch):
+    _write(tmp_path, "a_1.png")
+    bank = TemplateBank(str(tmp_path), check_interval=60)
+    assert [name for name, _ in bank.templates()] == ["a_1.png"]
+
+    calls = []
+    scan = bank._scan
+    monkeypatch.setattr(bank, "_scan", lambda: calls.append(1) or scan())
+
+    # 間隔の間はディレクトリを調べない（追加したテンプレートもまだ見えない）
+    _write(tmp_path, "b_1.png")
+    for _ in range(10):
+        bank.templates()
+    assert calls == [] and len(bank.templates()) == 1
+
+    # 間隔が過ぎたら調べ直して読み込む
+    bank._checked = time.monotonic() - 61
+    assert [name for name, _ in bank.templates()] == ["a_1.png", "b_1.png"]
+    assert calls == [1]
@@ -0,0 +1,33 @@
+import os
+
+from upload_index import UploadIndex
+
+def _touch(directory, name, mtime):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(b"x")
+    os.utime(path, (mtime, mtime))
+
+def test_existing_files_are_listed_when_add_runs_first(tmp_path):
+    _touch(tmp_path, "old1.jpeg", 1000)
+    _touch(tmp_path, "old2.png", 2000)
+    _touch(tmp_path, "notes.txt", 3000)
+
+    # ギャラリーを開く前にアップロードがあった場合
+    index = UploadIndex(str(tmp_path))
+    _touch(tmp_path, "new.jpeg", 4000)
+    index.add("new.jpeg")
+
+    assert index.count() == 3
+    assert [row[0] for row in index.page(1, 10)] == ["new.jpeg", "old2.png", "old1.jpeg"]
+
+def test_backfill_runs_once_per_database(tmp_path):
+    _touch(tmp_path, "old.jpeg", 1000)
+    UploadIndex(str(tmp_path)).count()
+
+    # 登録済みのデータベースを開き直しても走査しない（外部で追加したファイルは rebuild で登録）
+    _touch(tmp_path, "external.jpeg", 2000)
+    index = UploadIndex(str(tmp_path))
+    assert index.count() == 1
+    assert index.rebuild() == 2
+    assert index.count() == 2
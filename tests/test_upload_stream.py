@@ -0,0 +1,67 @@
+import io
+import os
+import json
+import base64
+import binascii
+import hashlib
+
+import pytest
+
+from upload_stream import FILE_MODE, Base64Decoder, iter_json_string, save_stream
+
+DATA = bytes(range(256)) * 5 + b"\xff\xd8tail"
+
+def _decode(encoded, chunk_size):
+    decoder = Base64Decoder()
+    out = b"".join(decoder.feed(encoded[i:i + chunk_size]) for i in range(0, len(encoded), chunk_size))
+    return out + decoder.finish()
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 4, 5, 7, 64, 10000])
+def test_base64_decoder_across_chunk_boundaries(chunk_size):
+    encoded = base64.b64encode(DATA)
+    assert _decode(encoded, chunk_size) == DATA
+    # 改行などの base64 以外の文字は無視する（base64.b64decode と同じ）
+    wrapped = base64.encodebytes(DATA)
+    assert _decode(wrapped, chunk_size) == base64.b64decode(wrapped) == DATA
+
+@pytest.mark.parametrize("size", [0, 1, 2, 3])
+def test_base64_decoder_padding(size):
+    assert _decode(base64.b64encode(DATA[:size]), 1) == DATA[:size]
+
+def test_base64_decoder_rejects_truncated_input():
+    with pytest.raises(binascii.Error):
+        _decode(base64.b64encode(DATA)[:-1], 3)
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 16, 10000])
+def test_iter_json_string_across_chunk_boundaries(chunk_size):
+    value = base64.b64encode(DATA).decode("ascii")
+    body = json.dumps({"name": "x.jpeg", "image_base64": value, "after": 1}).encode("utf-8")
+    chunks = list(iter_json_string(io.BytesIO(body), "image_base64", chunk_size))
+    assert b"".join(chunks).decode("ascii") == value
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 10000])
+def test_iter_json_string_escapes(chunk_size):
+    # json.dumps の "\/" はそのまま "/"、改行のエスケープは base64 では無視される文字として取り除く
+    body = b'{"image_base64": "ab\\/cd\\nef\\\\gh\\"ij"}'
+    chunks = list(iter_json_string(io.BytesIO(body), "image_base64", chunk_size))
+    assert b"".join(chunks) == b'ab/cdef\\gh"ij'
+
+def test_iter_json_string_missing_key():
+    with pytest.raises(KeyError):
+        list(iter_json_string(io.BytesIO(b'{"other": "abc"}'), "image_base64", 4))
+
+def test_iter_json_string_unterminated():
+    with pytest.raises(ValueError):
+        list(iter_json_string(io.BytesIO(b'{"image_base64": "abc'), "image_base64", 4))
+
+def test_save_stream_uses_default_file_mode(tmp_path):
+    encoded = base64.b64encode(DATA)
+    chunks = (encoded[i:i + 7] for i in range(0, len(encoded), 7))
+    path, file_hash, size = save_stream(chunks, str(tmp_path), decode_base64=True)
+    assert (file_hash, size) == (hashlib.md5(DATA).hexdigest(), len(DATA))
+    assert path == os.path.join(str(tmp_path), f"{file_hash}.jpeg")
+    assert os.stat(path).st_mode & 0o777 == FILE_MODE
+
+def test_save_stream_does_not_keep_empty_uploads(tmp_path):
+    assert save_stream(iter([]), str(tmp_path)) == (None, None, 0)
+    assert os.listdir(tmp_path) == []
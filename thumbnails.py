@@ -0,0 +1,157 @@
+import os
+import sys
+import time
+import threading
+
+import cv2
+
+# /python/files の一覧に表示するサムネイル。
+# JPEG は IMREAD_REDUCED_* で 1/2・1/4・1/8 に縮小しながらデコードできるので、
+# 原寸の画像を展開せずに小さな画像を作れる。作ったサムネイルはファイルとして保存し、
+# 件数・合計サイズの上限を超えたら最後に使われたのが古いものから追い出す。
+THUMBNAIL_DIR = "/var/www/html/opencv/.thumbnails"
+THUMBNAIL_WIDTH = int(os.environ.get("TIMETABLE_THUMBNAIL_WIDTH", "200"))
+THUMBNAIL_QUALITY = int(os.environ.get("TIMETABLE_THUMBNAIL_QUALITY", "80"))
+THUMBNAIL_MAX_ENTRIES = int(os.environ.get("TIMETABLE_THUMBNAIL_MAX_ENTRIES", "5000"))
+THUMBNAIL_MAX_BYTES = int(os.environ.get("TIMETABLE_THUMBNAIL_MAX_BYTES", str(256 * 1024 * 1024)))
+# 追い出しはディレクトリを走査するため、作成 EVICT_INTERVAL 回ごとに行う
+EVICT_INTERVAL = 50
+
+# 縮小率の大きい順（デコード結果が目的の幅に足りなければ次を試す）
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+    (1, cv2.IMREAD_COLOR)
+)
+
+def make_thumbnail(path, width=THUMBNAIL_WIDTH):
+    """
+    画像を縮小デコードして幅 width のサムネイルを作る（元の幅が小さい場合は拡大しない）
+
+    :return: 画像 (ndarray)
+    :raises ValueError: 画像を読み込めない場合
+    """
+    image = None
+    for factor, flag in _REDUCED_FLAGS:
+        image = cv2.imread(path, flag)
+        if image is None:
+            raise ValueError(f"Failed to decode image: {path}")
+        # 縮小後の幅が足りていれば、それ以上大きくデコードしない
+        if image.shape[1] >= width or factor == 1:
+            break
+
+    h, w = image.shape[:2]
+    if w > width:
+        image = cv2.resize(image, (width, max(1, round(h * width / w))), interpolation=cv2.INTER_AREA)
+    return image
+
+class ThumbnailCache:
+    """ サムネイルをファイルとして保存し、件数・合計サイズで LRU 的に追い出す """
+
+    def __init__(self, source_dir, cache_dir=THUMBNAIL_DIR, width=THUMBNAIL_WIDTH,
+                 max_entries=THUMBNAIL_MAX_ENTRIES, max_bytes=THUMBNAIL_MAX_BYTES):
+        self.source_dir = source_dir
+        self.cache_dir = cache_dir
+        self.width = width
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._created = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, filename):
+        # 拡張子も含めてキーにする（x.JPG・x.jpeg・x.png は別の画像）
+        return os.path.join(self.cache_dir, f"{filename}_{self.width}.jpeg")
+
+    def get(self, filename):
+        """
+        filename（source_dir 内の画像）のサムネイルのパスを返す。無い・元画像より古い場合は作る
+
+        :raises FileNotFoundError: 元画像が無い場合
+        :raises ValueError: 元画像を読み込めない場合
+        """
+        source = os.path.join(self.source_dir, filename)
+        source_mtime = os.stat(source).st_mtime
+        path = self._path(filename)
+        try:
+            if os.stat(path).st_mtime >= source_mtime:
+                # 最後に使われた時刻として atime を更新（追い出しの順序に使う）
+                os.utime(path, (time.time(), os.stat(path).st_mtime))
+                return path
+        except OSError:
+            pass
+
+        thumbnail = make_thumbnail(source, self.width)
+        ok, buf = cv2.imencode(".jpeg", thumbnail, [int(cv2.IMWRITE_JPEG_QUALITY), THUMBNAIL_QUALITY])
+        if not ok:
+            raise ValueError(f"Failed to encode thumbnail: {filename}")
+
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(buf.tobytes())
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._created += 1
+            evict = self._created % EVICT_INTERVAL == 0
+        if evict:
+            self.evict()
+        return path
+
+    def evict(self):
+        """ max_entries・max_bytes を超えた分を、最後に使われたのが古いものから削除 """
+        with self._lock:
+            entries = []
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if not entry.name.endswith(".jpeg"):
+                        continue
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((max(st.st_atime, st.st_mtime), st.st_size, entry.path))
+
+            entries.sort(reverse=True)
+            total = 0
+            for i, (_, size, path) in enumerate(entries):
+                total += size
+                if i >= self.max_entries or total > self.max_bytes:
+                    self._remove(path)
+
+    def clear(self):
+        """ すべてのサムネイルを削除 """
+        with self._lock:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".jpeg"):
+                    self._remove(os.path.join(self.cache_dir, name))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+# 管理用：python thumbnails.py <directory>  既存の画像のサムネイルをまとめて作る
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python thumbnails.py <directory>")
+        sys.exit(1)
+
+    from upload_index import is_image
+
+    cache = ThumbnailCache(sys.argv[1])
+    start = time.perf_counter()
+    n = 0
+    for name in sorted(os.listdir(sys.argv[1])):
+        if not is_image(name):
+            continue
+        try:
+            cache.get(name)
+            n += 1
+        except (OSError, ValueError) as e:
+            print(f"{name}\tError: {e}")
+    cache.evict()
+    print(f"{n} thumbnails in {time.perf_counter() - start:.2f} s")
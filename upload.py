@@ -1,12 +1,20 @@
 import os
 import hashlib
-import base64
-from flask import Flask, request, render_template_string
+import shutil
+import tempfile
+from flask import Flask, Response, request, render_template_string
 from files import files_bp  # ← ここで files.py をインポート
 from detect_table import detect_table
 from draw_rectangle import draw_rectangle
-from split_table import split_table
+from pipeline import store_upload
+from result_cache import ResultCache
+from job_queue import JobQueue, QueueFull
+from bulk import iter_zip, process_many, to_ndjson
+from upload_stream import iter_json_string, iter_stream, save_stream
 from view_table import view_table_bp
+from store_recognition import get_template_bank
+from upload_index import get_upload_index
+import metrics
 
 app = Flask(__name__)
 
@@ -15,34 +23,38 @@ ALLOWED_EXTENSIONS = {"jpg", "jpeg"}
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# 同じ画像の再アップロードは解析をやり直さずに前回の結果を返す
+result_cache = ResultCache()
+
+# 保存した画像は /python/files の一覧に登録する
+upload_index = get_upload_index(UPLOAD_FOLDER)
+
+# 店舗テンプレートをプロセス起動時に読み込んでおく（全リクエストで共有）
+try:
+    get_template_bank().templates()
+except OSError as e:
+    print(f"store template preload failed: {e}")
+
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 @app.route("/python/", methods=["GET", "POST"])
 def upload_file():
     if request.method == "POST":
-        if "file" in request.files:
-            file = request.files["file"]
-            if file.filename == "":
-                return "No selected file", 400
-            if file and allowed_file(file.filename):
-                file_data = file.read()
-            else:
-               return "jpeg only", 400 
-        elif "image_base64" in request.json:
-            try:
-                file_data = base64.b64decode(request.json["image_base64"])
-            except Exception as e:
-                return f"Invalid base64 data: {str(e)}", 400
-        else:
-            return "No file part", 400
-        
-        file_hash = hashlib.md5(file_data).hexdigest()
+        file_data, file_hash, error = receive_upload()
+        if error:
+            return error
+
         new_filename = f"{file_hash}.jpeg"
         filepath = os.path.join(UPLOAD_FOLDER, new_filename)
 
-        with open(filepath, "wb") as f:
-            f.write(file_data)
+        if file_data is not None:
+            with open(filepath, "wb") as f:
+                f.write(file_data)
+            upload_index.add(new_filename)
+            original_filename = request.files["file"].filename
+        else:
+            original_filename = new_filename  # ストリーミングで受け取った場合は保存済み
 
         return render_template_string("""
         <html>
@@ -54,7 +66,7 @@ def upload_file():
             <a href="/opencv/{{ new_filename }}" target="_blank">View File</a>
         </body>
         </html>
-        """, filename=file.filename, new_filename=new_filename)
+        """, filename=original_filename, new_filename=new_filename)
 
     return '''
     <!doctype html>
@@ -84,6 +96,7 @@ def detect_table_api():
 
     filepath = os.path.join(UPLOAD_FOLDER, file.filename)
     file.save(filepath)
+    upload_index.add(file.filename)
 
     try:
         coords = detect_table(filepath)
@@ -107,6 +120,7 @@ def draw_rectangle_api():
     # 画像を保存
     filepath = os.path.join(UPLOAD_FOLDER, file.filename)
     file.save(filepath)
+    upload_index.add(file.filename)
 
     try:
         # 矩形を検出
@@ -115,6 +129,7 @@ def draw_rectangle_api():
         # 赤い矩形を描画
         output_filepath = os.path.join(UPLOAD_FOLDER, f"rect_{file.filename}")
         draw_rectangle(filepath, output_filepath, coords)
+        upload_index.add(f"rect_{file.filename}")
 
         return {
             "original_image": f"/opencv/{file.filename}",
@@ -124,63 +139,132 @@ def draw_rectangle_api():
     except Exception as e:
         return {"error": str(e)}, 400
 
-@app.route("/python/split_table", methods=["POST"])
-def split_table_api():
-    if "file" in request.files:
+def receive_upload():
+    """
+    リクエストから画像データを受け取る
+
+    - multipart の file
+    - JSON の image_base64（本文を保持せずチャンク単位でデコードし、そのまま保存）
+    - application/octet-stream の本文（チャンク単位でそのまま保存）
+
+    :return: (file_data, file_hash, None) またはエラー時 (None, None, レスポンス)
+             ストリーミングで受け取った場合 file_data は None で、
+             画像は UPLOAD_FOLDER/<md5>.jpeg に保存済み
+    """
+    if request.mimetype == "application/octet-stream":
+        filepath, file_hash, size = save_stream(iter_stream(request.stream), UPLOAD_FOLDER)
+        if size == 0:
+            return None, None, ("No file part", 400)
+        upload_index.add(os.path.basename(filepath))
+        return None, file_hash, None
+    elif request.is_json:
+        try:
+            chunks = iter_json_string(request.stream, "image_base64")
+            filepath, file_hash, size = save_stream(chunks, UPLOAD_FOLDER, decode_base64=True)
+        except KeyError:
+            return None, None, ("No file part", 400)
+        except Exception as e:
+            return None, None, (f"Invalid base64 data: {str(e)}", 400)
+        if size == 0:
+            return None, None, ("No file part", 400)
+        upload_index.add(os.path.basename(filepath))
+        return None, file_hash, None
+    elif "file" in request.files:
         file = request.files["file"]
         if file.filename == "":
-            return "No selected file", 400
+            return None, None, ("No selected file", 400)
         if file and allowed_file(file.filename):
             file_data = file.read()
-        else:
-            return "jpeg only", 400 
-    elif "image_base64" in request.json:
-        try:
-            file_data = base64.b64decode(request.json["image_base64"])
-        except Exception as e:
-            return f"Invalid base64 data: {str(e)}", 400
-    else:
-            return "No file part", 400
-        
-    file_hash = hashlib.md5(file_data).hexdigest()
-    filename = f"{file_hash}.jpeg"
-    filepath = os.path.join(UPLOAD_FOLDER, filename)
-
-    with open(filepath, "wb") as f:
-        f.write(file_data)
+            return file_data, hashlib.md5(file_data).hexdigest(), None
+        return None, None, ("jpeg only", 400)
+    return None, None, ("No file part", 400)
 
+def run_split_table(file_data, file_hash):
     """
-    if "file" not in request.files:
-        return {"error": "No file uploaded"}, 400
-
-    file = request.files["file"]
-    if file.filename == "":
-        return {"error": "No selected file"}, 400
-
-    file_ext = os.path.splitext(file.filename)[1].lower()
-    if file_ext not in {".png", ".jpg", ".jpeg"}:
-        return {"error": "Invalid file type"}, 400
-
-    filepath = os.path.join(UPLOAD_FOLDER, file.filename)
-    file.save(filepath)
+    表検出〜店舗照合を実行し、split_table_api のレスポンスを返す（失敗時は例外）
     """
+    return store_upload(file_data, file_hash, UPLOAD_FOLDER, result_cache, upload_index)
 
-    try:
-        # 表の外枠を取得
-        table_coords = detect_table(filepath)
-
-        # セル分割       
-        cell_paths = split_table(filepath, table_coords, file_hash)
+@app.route("/python/split_table", methods=["POST"])
+def split_table_api():
+    file_data, file_hash, error = receive_upload()
+    if error:
+        return error
 
-        # 保存されたファイルのパスを返す
-        base_name = os.path.splitext(filename)[0]
-        return {
-            "directory": f"/opencv/{base_name}/",
-            "md5": f"{file_hash}",
-            "cells": [f"/opencv/{base_name}/{os.path.basename(cell)}" for cell in cell_paths]
-        }
+    # ?timings=1 の場合はステージごとの処理時間（秒）をレスポンスに付ける
+    with_timings = request.args.get("timings") == "1"
+    try:
+        with metrics.collect_timings() as timings, metrics.timed("split_table_api"):
+            response = run_split_table(file_data, file_hash)
     except Exception as e:
         return {"error": str(e)}, 400
+    if with_timings:
+        response = dict(response, timings={stage: round(t, 6) for stage, t in timings.items()})
+    return response
+
+# 非同期版：ジョブ ID（md5）をすぐに返し、解析はジョブキューのワーカーで行う
+split_table_jobs = JobQueue(run_split_table)
+
+@app.route("/python/split_table/jobs", methods=["POST"])
+def split_table_job_submit():
+    file_data, file_hash, error = receive_upload()
+    if error:
+        return error
+
+    try:
+        job = split_table_jobs.submit(file_hash, file_data, file_hash)
+    except QueueFull as e:
+        return {"error": str(e)}, 503, {"Retry-After": "5"}
+
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "status_url": f"/python/split_table/jobs/{job['id']}"
+    }, 202
+
+@app.route("/python/split_table/jobs/<job_id>", methods=["GET"])
+def split_table_job_status(job_id):
+    job = split_table_jobs.status(job_id)
+    if job is None:
+        return {"error": "Job not found"}, 404
+    return job
+
+@app.route("/python/split_table/jobs", methods=["GET"])
+def split_table_job_stats():
+    return split_table_jobs.stats()
+
+# 一括処理：multipart で複数の画像（zip も可）を受け取り、終わった順に NDJSON で返す
+@app.route("/python/split_table/bulk", methods=["POST"])
+def split_table_bulk_api():
+    files = request.files.getlist("file") + request.files.getlist("files")
+    files = [f for f in files if f.filename]
+    if not files:
+        return "No file part", 400
+
+    # リクエスト終了時にアップロードファイルは閉じられるため、ストリーミング中に
+    # 読み出せるよう一時ファイルへ移しておく（画像はワーカーが必要とした時に読む）
+    uploads = []
+    for file in files:
+        tmp = tempfile.TemporaryFile()
+        shutil.copyfileobj(file.stream, tmp)
+        tmp.seek(0)
+        uploads.append((file.filename, tmp))
+
+    def iter_uploads():
+        for filename, tmp in uploads:
+            with tmp:
+                if filename.lower().endswith(".zip"):
+                    yield from iter_zip(tmp)
+                elif allowed_file(filename):
+                    yield filename, tmp.read()
+
+    results = process_many(iter_uploads(), UPLOAD_FOLDER, result_cache, index=upload_index)
+    return Response(to_ndjson(results), mimetype="application/x-ndjson")
+
+# 処理時間・照合回数・キャッシュのヒット数などを Prometheus のテキスト形式で返す
+@app.route("/python/metrics", methods=["GET"])
+def metrics_api():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 #表示
 app.register_blueprint(view_table_bp)
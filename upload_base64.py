@@ -1,21 +1,43 @@
 import base64
+import json
 import requests
 
+CHUNK_SIZE = 48 * 1024  # 3 の倍数にして、チャンクごとの base64 にパディングが入らないようにする
+
 def encode_image_to_base64(image_path):
     """Encode an image file to a Base64 string."""
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode('utf-8')
 
+def iter_base64_payload(image_path, chunk_size=CHUNK_SIZE):
+    """Yield the JSON payload chunk by chunk without holding the whole Base64 string."""
+    filename = json.dumps(image_path.split("/")[-1])
+    yield f'{{"filename": {filename}, "image_base64": "'.encode("utf-8")
+    with open(image_path, "rb") as image_file:
+        while True:
+            chunk = image_file.read(chunk_size)
+            if not chunk:
+                break
+            yield base64.b64encode(chunk)
+    yield b'"}'
+
 def upload_base64_image(image_path, server_url):
-    """Upload an image as a Base64 string to the server."""
-    encoded_image = encode_image_to_base64(image_path)
-    
-    payload = {
-        "image_base64": encoded_image,
-        "filename": image_path.split("/")[-1]
-    }
-    
-    response = requests.post(server_url, json=payload)
+    """Upload an image as a Base64 string to the server (streamed, chunked transfer)."""
+    response = requests.post(
+        server_url,
+        data=iter_base64_payload(image_path),
+        headers={"Content-Type": "application/json"}
+    )
+    return response.json()
+
+def upload_raw_image(image_path, server_url):
+    """Upload an image as a raw application/octet-stream body (streamed from the file)."""
+    with open(image_path, "rb") as image_file:
+        response = requests.post(
+            server_url,
+            data=image_file,
+            headers={"Content-Type": "application/octet-stream"}
+        )
     return response.json()
 
 if __name__ == "__main__":
@@ -24,4 +46,3 @@ if __name__ == "__main__":
     
     response = upload_base64_image(image_path, server_url)
     print("Server Response:", response)
-
@@ -0,0 +1,152 @@
+import os
+import sys
+import time
+import sqlite3
+import threading
+
+# アップロードされた画像の一覧（SQLite）。
+# 保存した側が add() で登録し、/python/files は mtime の新しい順にページ単位で読む。
+# フォルダ全体の listdir と 1 ファイルごとの getmtime をページ表示のたびに行わずに済む。
+INDEX_FILENAME = ".upload_index.sqlite3"
+IMAGE_EXTENSIONS = {"jpg", "jpeg", "png", "gif"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    filename TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS uploads_mtime ON uploads (mtime DESC, filename);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+# 既存のファイルを登録済みであることを表す meta のキー。
+# 登録前に add() が呼ばれても（件数が 0 でなくても）、最初に開いたときに一度だけ走査する
+BACKFILLED = "backfilled"
+
+def is_image(filename):
+    return "." in filename and filename.rsplit(".", 1)[1].lower() in IMAGE_EXTENSIONS
+
+class UploadIndex:
+    """ directory 内の画像ファイル名・mtime・サイズを SQLite に保持する """
+
+    def __init__(self, directory, db_path=None):
+        self.directory = directory
+        self.db_path = db_path or os.path.join(directory, INDEX_FILENAME)
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    conn.executescript(_SCHEMA)
+                    self._backfill(conn)
+                    self._initialized = True
+        return conn
+
+    def _scan(self):
+        """ ディレクトリ内の画像の [(filename, mtime, size), ...] """
+        rows = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and is_image(entry.name):
+                    st = entry.stat()
+                    rows.append((entry.name, st.st_mtime, st.st_size))
+        return rows
+
+    def _backfill(self, conn):
+        """ まだ走査していなければ既存のファイルを登録する（add() 済みの行はそのまま） """
+        if conn.execute("SELECT 1 FROM meta WHERE key = ?", (BACKFILLED,)).fetchone():
+            return
+        rows = self._scan()
+        with conn:
+            # 複数のプロセスが同時に開いても一度だけ登録する
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM meta WHERE key = ?", (BACKFILLED,)).fetchone():
+                return
+            conn.executemany("INSERT OR IGNORE INTO uploads (filename, mtime, size) VALUES (?, ?, ?)", rows)
+            conn.execute("INSERT INTO meta (key, value) VALUES (?, ?)", (BACKFILLED, str(time.time())))
+
+    def add(self, filename, mtime=None, size=None):
+        """ ファイルを登録（既にあれば mtime・サイズを更新）。画像以外は無視する """
+        if not is_image(filename):
+            return
+        if mtime is None or size is None:
+            st = os.stat(os.path.join(self.directory, filename))
+            mtime, size = st.st_mtime, st.st_size
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT INTO uploads (filename, mtime, size) VALUES (?, ?, ?) "
+                "ON CONFLICT(filename) DO UPDATE SET mtime = excluded.mtime, size = excluded.size",
+                (filename, mtime, size)
+            )
+
+    def remove(self, filename):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM uploads WHERE filename = ?", (filename,))
+
+    def count(self):
+        return self._connect().execute("SELECT COUNT(*) FROM uploads").fetchone()[0]
+
+    def page(self, page=1, per_page=100):
+        """ mtime の新しい順に page ページ目（1 始まり）の [(filename, mtime, size), ...] を返す """
+        offset = (max(1, page) - 1) * per_page
+        return self._connect().execute(
+            "SELECT filename, mtime, size FROM uploads ORDER BY mtime DESC, filename LIMIT ? OFFSET ?",
+            (per_page, offset)
+        ).fetchall()
+
+    def rebuild(self):
+        """
+        ディレクトリを走査して一覧を作り直す（外部でファイルを追加・削除した場合）
+
+        :return: 登録したファイル数
+        """
+        rows = self._scan()
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM uploads")
+            conn.executemany("INSERT INTO uploads (filename, mtime, size) VALUES (?, ?, ?)", rows)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (BACKFILLED, str(time.time())))
+        return len(rows)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_upload_index(directory, db_path=None):
+    """ ディレクトリごとに共有される UploadIndex を取得 """
+    key = os.path.abspath(directory)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = UploadIndex(directory, db_path)
+            _indexes[key] = index
+    return index
+
+# 管理用：python upload_index.py rebuild|list <directory>
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in ("rebuild", "list"):
+        print("Usage: python upload_index.py rebuild|list <directory>")
+        sys.exit(1)
+
+    index = UploadIndex(sys.argv[2])
+    if sys.argv[1] == "rebuild":
+        start = time.perf_counter()
+        n = index.rebuild()
+        print(f"{n} files indexed in {time.perf_counter() - start:.2f} s")
+    else:
+        for filename, mtime, size in index.page(1, index.count()):
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(mtime))}\t{size}\t{filename}")
@@ -0,0 +1,141 @@
+import os
+import re
+import binascii
+import hashlib
+import tempfile
+
+# アップロード本文をチャンク単位で受け取り、md5 を計算しながらファイルへ書き出す。
+# JSON の image_base64 も文字列全体を保持せずに少しずつデコードするため、
+# 画像サイズに関係なくメモリ使用量はほぼ一定になる。
+CHUNK_SIZE = 64 * 1024
+
+# mkstemp は 0600 で作るため、open() で作った場合と同じ権限（0666 & ~umask）に直してから置き換える。
+# umask は取得するにも設定し直す必要があるので、import 時に一度だけ読む
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+FILE_MODE = 0o666 & ~_UMASK
+
+_NON_BASE64 = re.compile(rb"[^A-Za-z0-9+/=]")
+_JSON_SPECIAL = re.compile(rb'["\\]')
+_JSON_ESCAPES = {ord("/"): b"/", ord("\\"): b"\\", ord('"'): b'"',
+                 ord("n"): b"", ord("r"): b"", ord("t"): b""}
+
+class Base64Decoder:
+    """ base64 をチャンク単位でデコードする（base64.b64decode と同じく不正な文字は無視） """
+
+    def __init__(self):
+        self._rest = b""
+
+    def feed(self, data):
+        data = self._rest + _NON_BASE64.sub(b"", data)
+        n = len(data) - len(data) % 4
+        self._rest = data[n:]
+        return binascii.a2b_base64(data[:n]) if n else b""
+
+    def finish(self):
+        if self._rest:
+            raise binascii.Error("Incorrect padding")
+        return b""
+
+def iter_stream(stream, chunk_size=CHUNK_SIZE):
+    """ ストリームをチャンクごとに返す """
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+def iter_json_string(stream, key, chunk_size=CHUNK_SIZE):
+    """
+    JSON 本文から key の文字列値だけをチャンクごとに取り出す（値全体はメモリに載せない）
+
+    :raises KeyError: key が無い場合
+    :raises ValueError: 文字列が閉じていない場合
+    """
+    pattern = re.compile(rb'"' + re.escape(key.encode("utf-8")) + rb'"\s*:\s*"')
+    keep = len(key) + 64
+
+    # 値の開始位置まで読み進める
+    buf = b""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            raise KeyError(key)
+        buf += chunk
+        m = pattern.search(buf)
+        if m:
+            buf = buf[m.end():]
+            break
+        buf = buf[-keep:]
+
+    # 閉じる " まで、エスケープを処理しながら返す
+    escaped = False
+    while True:
+        out = bytearray()
+        i = 0
+        while i < len(buf):
+            if escaped:
+                if buf[i] not in _JSON_ESCAPES:
+                    raise ValueError(f"Unsupported escape in {key}")
+                out += _JSON_ESCAPES[buf[i]]
+                escaped = False
+                i += 1
+                continue
+            m = _JSON_SPECIAL.search(buf, i)
+            if m is None:
+                out += buf[i:]
+                break
+            out += buf[i:m.start()]
+            if buf[m.start()] == ord('"'):
+                if out:
+                    yield bytes(out)
+                return
+            escaped = True
+            i = m.end()
+        if out:
+            yield bytes(out)
+
+        buf = stream.read(chunk_size)
+        if not buf:
+            raise ValueError(f"Unterminated {key}")
+
+def receive_to_file(chunks, directory, decode_base64=False):
+    """
+    チャンクを（必要なら base64 デコードしながら）一時ファイルに書き出し、md5 を計算する
+
+    :return: (一時ファイルのパス, md5, バイト数) 呼び出し側で移動または削除すること
+    """
+    decoder = Base64Decoder() if decode_base64 else None
+    md5 = hashlib.md5()
+    size = 0
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            os.fchmod(f.fileno(), FILE_MODE)  # Web サーバーから /opencv/<md5>.jpeg として読めるように
+            for chunk in chunks:
+                data = decoder.feed(chunk) if decoder else chunk
+                md5.update(data)
+                f.write(data)
+                size += len(data)
+            if decoder:
+                decoder.finish()
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+    return tmp_path, md5.hexdigest(), size
+
+def save_stream(chunks, directory, decode_base64=False):
+    """
+    チャンクを受け取り <md5>.jpeg として directory に保存する
+
+    :return: (保存先のパス, md5, バイト数)。空の場合は保存せず (None, None, 0)
+    """
+    tmp_path, file_hash, size = receive_to_file(chunks, directory, decode_base64)
+    if size == 0:
+        os.remove(tmp_path)
+        return None, None, 0
+    filepath = os.path.join(directory, f"{file_hash}.jpeg")
+    os.replace(tmp_path, filepath)
+    return filepath, file_hash, size
@@ -1,37 +1,23 @@
-from flask import Blueprint, request, render_template_string
+from flask import Blueprint, Response, abort, request, render_template_string, send_file
 import os
 import json
+import base64
 
-view_table_bp = Blueprint('view_table', __name__)
-
-@view_table_bp.route("/python/view_table", methods=["GET"])
-def view_table():
-    base_name = request.args.get("file")  # 例: "001"
-    if not base_name:
-        return "Error: No file specified", 400
-
-    directory = os.path.join("/var/www/html/opencv", base_name)
-    json_path = os.path.join(directory, "cells.json")
-
-    if not os.path.exists(directory):
-        return "Error: Directory not found", 404
-    if not os.path.exists(json_path):
-        return "Error: cells.json not found", 404
+from contact_sheet import SHEET_TILE, get_contact_sheet
+from result_format import read_result
 
-    # JSONデータを読み込む
-    with open(json_path, "r") as json_file:
-        cells_data = json.load(json_file)
+view_table_bp = Blueprint('view_table', __name__)
 
-    # 5列7行のテーブルを作成
-    rows, cols = 7, 5  # 修正：7行5列に固定
+OUTPUT_ROOT = "/var/www/html/opencv"
+# js:     従来どおり HTML の後で cells.json とセル画像をブラウザが個別に取りに行く
+# sheet:  セルの情報は HTML に埋め込み、画像はコンタクトシート 1 枚（計 2 リクエスト）
+# inline: コンタクトシートも data URI で HTML に埋め込む（1 リクエスト）
+VIEW_MODES = ("js", "sheet", "inline")
+# HTML は短時間だけキャッシュし、その後は ETag で再検証する（再解析で結果が変わるため）
+VIEW_MAX_AGE = 60
+SHEET_MAX_AGE = 365 * 24 * 3600
 
-    # HTML をレンダリング
-    html_template = """
-    <!DOCTYPE html>
-    <html lang="ja">
-    <head>
-        <meta charset="UTF-8">
-        <title>Table View</title>
+TABLE_STYLE = """
         <style>
             table {
                 border-collapse: collapse;
@@ -79,6 +65,81 @@ def view_table():
                 font-size:large;
             }
         </style>
+"""
+
+def result_etag(base_name, json_path, *parts):
+    """ 結果（cells.json）が書き換わると変わる ETag。ディレクトリ名は画像の md5 """
+    st = os.stat(json_path)
+    return "-".join([base_name, format(st.st_mtime_ns, "x"), format(st.st_size, "x")] + [str(p) for p in parts])
+
+def _read_result(directory):
+    """ cells.bin を開く。無い・壊れている（空・途中で切れている）場合は None（cells.json を使う） """
+    try:
+        return read_result(directory)
+    except (OSError, ValueError):
+        return None
+
+def load_cells(directory, json_path):
+    """ (rows, cols, cells_info) cells.bin があればそれを読み、無ければ cells.json から求める """
+    result = _read_result(directory)
+    if result is not None:
+        with result:
+            return result.rows, result.columns, result.cells_info()
+    with open(json_path, "r") as json_file:
+        cells = json.load(json_file).get("cells", [])
+    rows = max((cell["row"] for cell in cells), default=6) + 1
+    cols = max((cell["column"] for cell in cells), default=4) + 1
+    return rows, cols, cells
+
+def _cacheable(response, etag, max_age, immutable=False):
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    if immutable:
+        response.cache_control.immutable = True
+    return response
+
+def _result_paths(base_name):
+    if not base_name or os.path.basename(base_name) != base_name or base_name.startswith("."):
+        abort(400)
+    directory = os.path.join(OUTPUT_ROOT, base_name)
+    return directory, os.path.join(directory, "cells.json")
+
+@view_table_bp.route("/python/view_table", methods=["GET"])
+def view_table():
+    base_name = request.args.get("file")  # 例: "001"
+    if not base_name:
+        return "Error: No file specified", 400
+    mode = request.args.get("mode", "js")
+    if mode not in VIEW_MODES:
+        return "Error: Unknown mode", 400
+
+    directory, json_path = _result_paths(base_name)
+
+    if not os.path.exists(directory):
+        return "Error: Directory not found", 404
+    if not os.path.exists(json_path):
+        return "Error: cells.json not found", 404
+
+    etag = result_etag(base_name, json_path, mode, SHEET_TILE)
+    if request.if_none_match.contains(etag):
+        return _cacheable(Response(status=304), etag, VIEW_MAX_AGE)
+
+    if mode != "js":
+        response = Response(render_sheet_view(base_name, directory, json_path, mode, etag))
+        return _cacheable(response, etag, VIEW_MAX_AGE)
+
+    # 行数・列数は結果から求める（様式によって異なる）
+    rows, cols, _ = load_cells(directory, json_path)
+
+    # HTML をレンダリング
+    html_template = """
+    <!DOCTYPE html>
+    <html lang="ja">
+    <head>
+        <meta charset="UTF-8">
+        <title>Table View</title>
+        {{ style|safe }}
         <script>
             document.addEventListener("DOMContentLoaded", function() {
                 fetch("../opencv/{{ base_name }}/cells.json")
@@ -109,7 +170,7 @@ def view_table():
         <h2>Table: {{ base_name }}</h2>
         <table>
             <tr>
-                <td colspan="5" id="header_row" class="header_row">
+                <td colspan="{{ cols }}" id="header_row" class="header_row">
                 </td>
             </tr>
             {% for r in range(rows) %}
@@ -123,5 +184,96 @@ def view_table():
     </body>
     </html>
     """
-    return render_template_string(html_template, base_name=base_name, rows=rows, cols=cols)
+    html = render_template_string(html_template, base_name=base_name, rows=rows, cols=cols, style=TABLE_STYLE)
+    return _cacheable(Response(html), etag, VIEW_MAX_AGE)
+
+def render_sheet_view(base_name, directory, json_path, mode, etag):
+    """ セルの情報をサーバー側で埋め込んだ HTML（画像はコンタクトシート） """
+    rows, cols, cells_info = load_cells(directory, json_path)
+    try:
+        sheet_path, header_height = get_contact_sheet(directory, rows, cols, cells_info)
+    except FileNotFoundError:
+        abort(404)
+
+    if mode == "inline":
+        with open(sheet_path, "rb") as f:
+            sheet_url = "data:image/jpeg;base64," + base64.b64encode(f.read()).decode("ascii")
+    else:
+        sheet_url = f"../python/view_table/{base_name}/sheet.jpeg?v={etag}"
+
+    html_template = """
+    <!DOCTYPE html>
+    <html lang="ja">
+    <head>
+        <meta charset="UTF-8">
+        <title>Table View</title>
+        {{ style|safe }}
+        <style>
+            .td, .header_row {
+                background-image: url('{{ sheet_url }}');
+                background-size: {{ sheet_width }}px {{ sheet_height }}px;
+                background-repeat: no-repeat;
+            }
+            .td {
+                width: {{ tile }}px;
+                height: {{ tile }}px;
+            }
+            .header_row {
+                height: {{ header_height }}px;
+                background-position: 0 0;
+            }
+        </style>
+    </head>
+    <body>
+        <h2>Table: {{ base_name }}</h2>
+        <table>
+            <tr>
+                <td colspan="{{ cols }}" id="header_row" class="header_row">
+                </td>
+            </tr>
+            {% for r in range(rows) %}
+                <tr>
+                    {% for c in range(cols) %}
+                        {% set cell = cells.get((r, c)) %}
+                        {% if cell %}
+                        <td class="td" id="cell_{{ r }}_{{ c }}" style="background-position: -{{ c * tile }}px -{{ header_height + r * tile }}px">
+                            {{ cell.filename }}<br/><span class="type_{{ cell.type }}">{{ cell.type }}</span>
+                            {% if cell.store_match %}
+                            <br/><span class="store">{{ cell.store_match[0][0] }}</span><br/><span class="store_score">{{ "%.2f"|format(cell.store_match[0][1]) }}</span>
+                            {% endif %}
+                        </td>
+                        {% else %}
+                        <td class="td" id="cell_{{ r }}_{{ c }}" style="background-image: none"></td>
+                        {% endif %}
+                    {% endfor %}
+                </tr>
+            {% endfor %}
+        </table>
+    </body>
+    </html>
+    """
+    sheet_width = cols * SHEET_TILE
+    return render_template_string(
+        html_template, base_name=base_name, rows=rows, cols=cols, style=TABLE_STYLE, tile=SHEET_TILE,
+        cells={(cell["row"], cell["column"]): cell for cell in cells_info},
+        sheet_url=sheet_url, sheet_width=sheet_width, sheet_height=header_height + rows * SHEET_TILE,
+        header_height=header_height
+    )
+
+@view_table_bp.route("/python/view_table/<base_name>/sheet.jpeg", methods=["GET"])
+def view_table_sheet(base_name):
+    directory, json_path = _result_paths(base_name)
+    if not os.path.exists(json_path):
+        abort(404)
+
+    etag = result_etag(base_name, json_path, "sheet", SHEET_TILE)
+    if request.if_none_match.contains(etag):
+        return _cacheable(Response(status=304), etag, SHEET_MAX_AGE, immutable=True)
 
+    rows, cols, cells_info = load_cells(directory, json_path)
+    try:
+        sheet_path, _ = get_contact_sheet(directory, rows, cols, cells_info)
+    except FileNotFoundError:
+        abort(404)
+    response = send_file(sheet_path, mimetype="image/jpeg", conditional=False, etag=False, max_age=SHEET_MAX_AGE)
+    return _cacheable(response, etag, SHEET_MAX_AGE, immutable=bool(request.args.get("v")))
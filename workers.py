@@ -0,0 +1,61 @@
+import os
+import threading
+import contextvars
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# セル解析の実行方式: "serial" / "thread" / "process"
+# OpenCV の処理は GIL を解放するため、通常は "thread" で十分にスケールする
+BACKENDS = ("serial", "thread", "process")
+EXECUTOR_BACKEND = os.environ.get("TIMETABLE_EXECUTOR", "thread")
+MAX_WORKERS = int(os.environ.get("TIMETABLE_WORKERS", "0")) or os.cpu_count() or 1
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+def get_executor(backend=None, max_workers=None):
+    """
+    実行方式に応じたプール（プロセス内で共有）を返す。serial の場合は None
+
+    :param backend: "serial" / "thread" / "process"（省略時は EXECUTOR_BACKEND）
+    :param max_workers: ワーカー数（省略時は MAX_WORKERS）
+    """
+    backend = backend or EXECUTOR_BACKEND
+    max_workers = max_workers or MAX_WORKERS
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown executor backend: {backend}")
+    if backend == "serial" or max_workers <= 1:
+        return None
+
+    key = (backend, max_workers)
+    with _executors_lock:
+        executor = _executors.get(key)
+        if executor is None:
+            if backend == "thread":
+                executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cells")
+            else:
+                executor = ProcessPoolExecutor(max_workers=max_workers)
+            _executors[key] = executor
+    return executor
+
+def map_ordered(fn, *iterables, backend=None, max_workers=None):
+    """
+    fn を並列に適用し、入力と同じ順序で結果のリストを返す
+
+    スレッドで実行する場合は呼び出し元のコンテキスト（metrics.collect_timings の集計先など）を
+    引き継ぐ。プロセスで実行する場合は引き継がれない。
+    """
+    executor = get_executor(backend, max_workers)
+    if executor is None:
+        return list(map(fn, *iterables))
+    if isinstance(executor, ThreadPoolExecutor):
+        # 同じ Context を複数のスレッドで同時に run できないため、呼び出しごとに複製する
+        context = contextvars.copy_context()
+        return list(executor.map(lambda *args: context.copy().run(fn, *args), *iterables))
+    return list(executor.map(fn, *iterables))
+
+def shutdown():
+    """ 共有プールをすべて終了する """
+    with _executors_lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=True)
+        _executors.clear()